@@ -0,0 +1,119 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+def digest(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskCache:
+    """Content-addressed text blobs on disk with LRU and TTL eviction.
+
+    Entries live in `directory` as <key[:2]>/<key>, the first line holding
+    the time the entry was written. A hit touches the file's mtime, so the
+    oldest mtimes are the least recently used; when the total size passes
+    `max_bytes` those are deleted first. Entries written more than `ttl`
+    seconds ago are treated as misses and removed, however often they are read.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total = None
+
+    @staticmethod
+    def key(*parts):
+        """Key for a tuple of parts (e.g. model, template, input hash, quiz type)."""
+        h = hashlib.sha256()
+        for part in parts:
+            data = str(part).encode('utf-8')
+            h.update(len(data).to_bytes(8, 'big'))
+            h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                try:
+                    created = float(f.readline())
+                except ValueError:
+                    # Written before entries carried their creation time
+                    created = None
+                expired = created is None or (self.ttl and time.time() - created > self.ttl)
+                value = None if expired else f.read()
+            if expired:
+                self._remove(path, os.stat(path).st_size)
+                raise FileNotFoundError(path)
+            # The mtime only orders entries for LRU eviction; the TTL goes by `created`
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(f'{time.time():.3f}\n')
+            f.write(value)
+        try:
+            old_size = os.stat(path).st_size
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total = self._scan_total() if self._total is None else self._total - old_size + os.stat(path).st_size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return
+        for sub in os.scandir(self.directory):
+            if sub.is_dir():
+                for entry in os.scandir(sub.path):
+                    if not entry.name.endswith('.tmp'):
+                        yield entry
+
+    def _scan_total(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self):
+        # Caller holds self._lock
+        entries = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in self._entries()))
+        for _, size, path in entries:
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._total -= size
+            except FileNotFoundError:
+                pass
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._total is not None:
+                self._total -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -1,12 +1,28 @@
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+import time
+import bisect
+import logging
+import threading
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response, stream_with_context, g
 import json
 import random
 from datetime import datetime, timedelta
-import google.generativeai as genai
-from PyPDF2 import PdfReader
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from requests_oauthlib import OAuth2Session
+from store import new_id, open_store, write_json
+from cache import CachedCardStore, JsonFileCache, count_stats, day_starts, due_timestamp
+from distractors import DistractorEngine
+from importer import IMPORT_FORMATS, ImportFormatError, import_stream
+from gemini import cards_for_prompt, client_stats, get_client, needs_api_key
+from jobs import JobError, JobQueue, QueueFull
+from ai_cache import DiskCache, digest
+from importer import content_key
+from pdf_ingest import extract_pages, ingest
+from batch import apply_batch
+from dedup import DUPLICATE_MODES, SIMILARITY, insert_cards, merge_clusters, review_rank
+from reviews import RATINGS, ReviewLog, apply_review_events
+import scheduler as scheduling
+from scheduler import SCHEDULERS, get_scheduler, optimize_fsrs, reschedule_cards
+from metrics import Registry, log_event, profile_report, start_profile
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
@@ -14,6 +30,7 @@ if os.environ.get('FLASK_ENV') == 'development': # Use FLASK_ENV to determine de
     pass # This block is now redundant for OAUTHLIB_INSECURE_TRANSPORT
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 app.config['PREFERRED_URL_SCHEME'] = 'https'
 # app.config['SERVER_NAME'] = 'ars-berlin.de'
 
@@ -69,58 +86,208 @@ def extract_json_from_markdown(text):
         
     return text.strip()
 
+def card_fields():
+    """The `fields` query arg as a list of card keys, or None for whole cards."""
+    fields = request.args.get('fields')
+    if fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    return fields or None
+
+def card_page_args():
+    """limit/after_id/fields query args shared by the card listing endpoints.
+
+    Raises ValueError for a limit below 1.
+    """
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        raise ValueError('limit must be at least 1')
+    return limit, request.args.get('after_id'), card_fields()
+
+def paginate(items, limit, after_id):
+    """Cursor pagination: the page after `after_id`, plus the cursor for the next page.
+
+    Raises KeyError if `after_id` is not in `items` (e.g. the card was deleted).
+    """
+    start = 0
+    if after_id:
+        start = next((i + 1 for i, item in enumerate(items) if item['id'] == after_id), None)
+        if start is None:
+            raise KeyError(after_id)
+    end = start + limit if limit else len(items)
+    page = items[start:end]
+    next_after_id = page[-1]['id'] if page and end < len(items) else None
+    return page, next_after_id
+
+def project(card, fields):
+    if not fields:
+        return card
+    return {field: card[field] for field in fields if field in card}
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+def ndjson_response(items, headers=None):
+    """Stream one JSON document per line, so the body is never built in memory."""
+    def generate():
+        for item in items:
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
 def get_cards(deck_id=None):
-    if not os.path.exists(CARDS_FILE):
-        return []
-    with open(CARDS_FILE, 'r') as f:
-        cards = json.load(f)
-        if deck_id:
-            return [card for card in cards if card.get('deck_id') == deck_id]
-        return cards
+    if deck_id:
+        return store.cards_in_deck(deck_id)
+    return store.all_cards()
 
 def save_cards(cards):
-    with open(CARDS_FILE, 'w') as f:
-        json.dump(cards, f, indent=4)
+    store.replace_cards(cards)
 
 def get_decks():
-    if not os.path.exists(DECKS_FILE):
-        return []
-    with open(DECKS_FILE, 'r') as f:
-        return json.load(f)
+    return store.get_decks()
 
 def save_decks(decks):
-    with open(DECKS_FILE, 'w') as f:
-        json.dump(decks, f, indent=4)
+    store.save_decks(decks)
+
+# Parsed config.json, re-read only when the file changes on disk
+config_cache = JsonFileCache()
 
 def get_config():
-    if not os.path.exists(CONFIG_FILE):
-        return {'quiz_questions': 10, 'gemini_api_key': '', 'gemini_model': 'gemini-pro', 'new_cards_per_day': 20, 'question_language': 'en-US', 'answer_language': 'en-US', 'GOOGLE_CLIENT_ID': '', 'GOOGLE_CLIENT_SECRET': '', 'GOOGLE_LOGIN_ENABLED': True}
-    with open(CONFIG_FILE, 'r') as f:
-        config = json.load(f)
-        if 'new_cards_per_day' not in config:
-            config['new_cards_per_day'] = 20
-        if 'question_language' not in config:
-            config['question_language'] = 'en-US'
-        if 'answer_language' not in config:
-            config['answer_language'] = 'en-US'
-        if 'GOOGLE_CLIENT_ID' not in config:
-            config['GOOGLE_CLIENT_ID'] = ''
-        if 'GOOGLE_CLIENT_SECRET' not in config:
-            config['GOOGLE_CLIENT_SECRET'] = ''
-        if 'GOOGLE_LOGIN_ENABLED' not in config:
-            config['GOOGLE_LOGIN_ENABLED'] = True
-        if 'disable_google_login' not in config:
-            config['disable_google_login'] = False
-        return config
+    cached = config_cache.get(CONFIG_FILE)
+    if cached is None:
+        return {'quiz_questions': 10, 'gemini_api_key': '', 'gemini_model': 'gemini-pro', 'new_cards_per_day': 20, 'question_language': 'en-US', 'answer_language': 'en-US', 'GOOGLE_CLIENT_ID': '', 'GOOGLE_CLIENT_SECRET': '', 'GOOGLE_LOGIN_ENABLED': True, 'card_store': 'json'}
+    # Callers modify the config they get back, so hand out a copy
+    config = dict(cached)
+    if 'new_cards_per_day' not in config:
+        config['new_cards_per_day'] = 20
+    if 'question_language' not in config:
+        config['question_language'] = 'en-US'
+    if 'answer_language' not in config:
+        config['answer_language'] = 'en-US'
+    if 'GOOGLE_CLIENT_ID' not in config:
+        config['GOOGLE_CLIENT_ID'] = ''
+    if 'GOOGLE_CLIENT_SECRET' not in config:
+        config['GOOGLE_CLIENT_SECRET'] = ''
+    if 'GOOGLE_LOGIN_ENABLED' not in config:
+        config['GOOGLE_LOGIN_ENABLED'] = True
+    if 'disable_google_login' not in config:
+        config['disable_google_login'] = False
+    if 'card_store' not in config:
+        config['card_store'] = 'json'
+    return config
 
 def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+    write_json(CONFIG_FILE, config)
+
+# Card store, job queue and caches; set up from config.json by create_app
+store = None
+job_queue = None
+ai_cache = None
+review_log = None
+_create_lock = threading.Lock()
+# Per-deck answer arrays for multiple-choice quizzes, rebuilt when cards change
+distractor_engine = DistractorEngine()
+
+def create_app(preload=False):
+    """Set up the card store and background services from config.json and return the app.
+
+    Not an app factory: it fills in this module's globals and always
+    returns the same module-level `app`, so there is one app per process.
+    Safe to call more than once; only the first call does the work. With
+    preload the card index is also loaded right away, e.g. in the gunicorn
+    master before it forks its workers, so they start out sharing it.
+    """
+    global store, job_queue, ai_cache, review_log
+    with _create_lock:
+        if store is None:
+            config = get_config()
+            # Card storage backend: 'json' or 'sqlite' (migrated from cards.json on first start)
+            # Reads are served from an in-memory, deck-partitioned index kept in front of it
+            cards = CachedCardStore(open_store(config, CARDS_FILE, DECKS_FILE))
+            # Gemini calls run here instead of on request threads; with job_state_dir set, job state is
+            # shared with other workers on disk
+            job_queue = JobQueue(max_workers=config.get('ai_max_concurrent_jobs', 2), timeout=config.get('ai_job_timeout', 120),
+                                 state_dir=config.get('job_state_dir'))
+            # Gemini responses and extracted PDF text, keyed by a hash of their inputs
+            ai_cache = DiskCache(config.get('ai_cache_dir', 'ai_cache'),
+                                 max_bytes=config.get('ai_cache_max_mb', 64) * 1024 * 1024,
+                                 ttl=config.get('ai_cache_ttl_days', 7) * 24 * 3600)
+            # Every applied review, one JSON object per line; the scheduler optimizer reads it
+            review_log = ReviewLog(config.get('review_log_path', 'review_log.ndjson'))
+            store = cards
+    if preload:
+        store.warm()
+    return app
+
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+request_seconds = metrics.histogram('flashcard_request_duration_seconds', 'Request latency by route.',
+                                    ('route', 'method', 'status'))
+gemini_seconds = metrics.histogram('flashcard_gemini_request_duration_seconds', 'Gemini generate_content latency.',
+                                   ('backend',))
+gemini_errors = metrics.counter('flashcard_gemini_errors_total', 'Failed or unparseable Gemini responses.',
+                                ('backend', 'reason'))
+
+def collect_store_metrics():
+    cards = store.stats()
+    backend = type(store.store).__name__
+    caches = {'cards': cards, 'config': config_cache.stats(), 'ai': ai_cache.stats()}
+    gemini = client_stats()
+    return [
+        ('flashcard_store_loads_total', 'counter', 'Full reads of the collection from the backend.',
+         [({'backend': backend}, cards['misses'])]),
+        ('flashcard_store_load_seconds_total', 'counter', 'Time spent reading the collection from the backend.',
+         [({'backend': backend}, cards['load_seconds'])]),
+        ('flashcard_store_writes_total', 'counter', 'Card writes, before group commit.',
+         [({'backend': backend}, cards['writes'])]),
+        ('flashcard_store_write_batches_total', 'counter', 'Group-committed flushes to the backend.',
+         [({'backend': backend}, cards['write_batches'])]),
+        ('flashcard_store_write_seconds_total', 'counter', 'Time spent writing cards to the backend.',
+         [({'backend': backend}, cards['flush_seconds'])]),
+        ('flashcard_store_bytes_written_total', 'counter', 'Card data written to the backend.',
+         [({'backend': backend}, cards['bytes_written'])]),
+        ('flashcard_gemini_calls_total', 'counter', 'Gemini requests sent, including retries and batched calls.',
+         [({}, gemini['calls'])]),
+        ('flashcard_gemini_retries_total', 'counter', 'Gemini requests retried after a transient error.',
+         [({}, gemini['retries'])]),
+        ('flashcard_gemini_batched_prompts_total', 'counter', 'Prompts answered as part of a batched call.',
+         [({}, gemini['batched_prompts'])]),
+        ('flashcard_gemini_throttled_seconds_total', 'counter', 'Time spent waiting on the Gemini rate limiter.',
+         [({}, gemini['throttled_seconds'])]),
+        ('flashcard_cache_hits_total', 'counter', 'Cache hits.',
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ('flashcard_cache_misses_total', 'counter', 'Cache misses.',
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+    ]
+
+metrics.add_collector(collect_store_metrics)
+
+@app.before_request
+def ensure_created():
+    # Servers that import `app` directly (flask run, a test client) get the same setup lazily
+    if store is None:
+        create_app()
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    # Opt-in per-request profile, e.g. /api/learn/data?deck_id=1&profile=1
+    if request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1':
+        if get_config().get('profiling_enabled', False):
+            g.profiler = start_profile()
+
+@app.after_request
+def finish_request_timing(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_seconds.observe(time.perf_counter() - started, route=route, method=request.method,
+                                status=str(response.status_code))
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # Streamed bodies are produced after this point and aren't included
+        report = profile_report(profiler, get_config().get('profile_limit', 40))
+        return Response(report, mimetype='text/plain', headers={'X-Profiled-Status': str(response.status_code)})
+    return response
 
-# Google OAuth Configuration
-config = get_config()
-GOOGLE_CLIENT_ID = config.get('GOOGLE_CLIENT_ID')
-GOOGLE_CLIENT_SECRET = config.get('GOOGLE_CLIENT_SECRET')
 GOOGLE_AUTHORIZATION_BASE_URL = "https://accounts.google.com/o/oauth2/v2/auth"
 GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
@@ -131,7 +298,9 @@ def login():
     config = get_config()
     if config.get('disable_google_login', False): # Default to False if not set
         return redirect(url_for('index'))
-    google = OAuth2Session(GOOGLE_CLIENT_ID, scope=GOOGLE_SCOPE, redirect_uri=url_for('callback', _external=True, _scheme='https'))
+    # Imported on first use: only the login flow needs it, and it is slow to import
+    from requests_oauthlib import OAuth2Session
+    google = OAuth2Session(config.get('GOOGLE_CLIENT_ID'), scope=GOOGLE_SCOPE, redirect_uri=url_for('callback', _external=True, _scheme='https'))
     authorization_url, state = google.authorization_url(GOOGLE_AUTHORIZATION_BASE_URL, access_type="offline", prompt="select_account")
     session['oauth_state'] = state
     return redirect(authorization_url)
@@ -141,8 +310,10 @@ def callback():
     if 'oauth_state' not in session or session['oauth_state'] != request.args.get('state'):
         return jsonify({'error': 'Invalid state parameter'}), 400
 
-    google = OAuth2Session(GOOGLE_CLIENT_ID, state=session['oauth_state'], redirect_uri=url_for('callback', _external=True, _scheme='https'))
-    token = google.fetch_token(GOOGLE_TOKEN_URL, client_secret=GOOGLE_CLIENT_SECRET, authorization_response=request.url)
+    from requests_oauthlib import OAuth2Session
+    config = get_config()
+    google = OAuth2Session(config.get('GOOGLE_CLIENT_ID'), state=session['oauth_state'], redirect_uri=url_for('callback', _external=True, _scheme='https'))
+    token = google.fetch_token(GOOGLE_TOKEN_URL, client_secret=config.get('GOOGLE_CLIENT_SECRET'), authorization_response=request.url)
     
     userinfo_response = google.get(GOOGLE_USERINFO_URL)
     user_info = userinfo_response.json()
@@ -170,35 +341,187 @@ def get_all_decks():
 @app.route('/api/decks', methods=['POST'])
 @login_required_conditional
 def add_deck():
-    decks = get_decks()
     new_deck = request.get_json()
-    new_deck['id'] = str(random.randint(1000, 9999))
-    decks.append(new_deck)
-    save_decks(decks)
+    new_deck['id'] = new_id()
+    store.add_deck(new_deck)
     return jsonify(new_deck)
 
+@app.route('/api/decks/<deck_id>', methods=['DELETE'])
+@login_required_conditional
+def delete_deck(deck_id):
+    deck_ids = {deck['id'] for deck in get_decks()}
+    if deck_id not in deck_ids:
+        return jsonify({'error': 'Deck not found'}), 404
+    # The deck's cards go in one batch commit, then the deck itself. They are
+    # picked inside the commit, so a card added meanwhile isn't left behind
+    def delete_cards(index):
+        ops = [{'op': 'delete', 'id': card_id} for card_id in list(index.by_deck.get(deck_id, {}))]
+        return apply_batch(ops, deck_ids)(index)
+    ok, results = store.mutate(delete_cards)
+    if not ok:
+        return jsonify({'error': 'Could not delete the deck\'s cards', 'results': results}), 409
+    store.remove_deck(deck_id)
+    return jsonify({'message': 'Deck deleted', 'cards_deleted': len(results)})
+
 @app.route('/api/decks/<deck_id>/cards', methods=['GET'])
 @login_required_conditional
 def get_deck_cards(deck_id):
-    return jsonify(get_cards(deck_id))
+    try:
+        limit, after_id, fields = card_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        page, next_after_id = store.deck_page(deck_id, limit, after_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown after_id'}), 400
+
+    if wants_ndjson():
+        return ndjson_response((project(card, fields) for card in page), {'X-Next-After-Id': next_after_id or ''})
+    page = [project(card, fields) for card in page]
+    if limit is None and after_id is None:
+        # Unpaginated requests keep the original plain-list response
+        return jsonify(page)
+    return jsonify({'cards': page, 'next_after_id': next_after_id})
+
+@app.route('/api/search', methods=['GET'])
+@login_required_conditional
+def search_cards():
+    query = request.args.get('q', '')
+    deck_id = request.args.get('deck_id')
+    try:
+        limit, after_id, fields = card_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(limit or 50, 500)
+    ids = store.search(query, deck_id)
+    # Results are sorted by id, so the cursor is just a position in that order
+    start = bisect.bisect_right(ids, after_id) if after_id else 0
+    page = [store.get_card(card_id) for card_id in ids[start:start + limit]]
+    next_after_id = page[-1]['id'] if page and start + limit < len(ids) else None
+    return jsonify({'results': [project(card, fields) for card in page if card], 'total': len(ids),
+                    'next_after_id': next_after_id})
+
+def duplicate_args(source):
+    """The 'skip_duplicates' mode ('exact', 'near' or None) and similarity threshold from a request.
+
+    Raises ValueError for an unknown mode or a threshold outside (0, 1].
+    """
+    mode = source.get('skip_duplicates') or None
+    if mode is not None and mode not in DUPLICATE_MODES:
+        raise ValueError(f"skip_duplicates must be one of: {', '.join(DUPLICATE_MODES)}")
+    threshold = float(source.get('threshold') or get_config().get('dedup_threshold', SIMILARITY))
+    if not 0 < threshold <= 1:
+        raise ValueError('threshold must be between 0 and 1')
+    return mode, threshold
 
 @app.route('/api/cards', methods=['POST'])
 @login_required_conditional
 def add_card():
-    cards = get_cards()
+    try:
+        mode, threshold = duplicate_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     new_card = request.get_json()
-    new_card['id'] = str(random.randint(1000, 9999))
+    new_card['id'] = new_id()
     new_card['due_date'] = datetime.now().isoformat()
     new_card['interval'] = 0
-    cards.append(new_card)
-    save_cards(cards)
+    if mode:
+        store.prepare_duplicates()
+    added, duplicates = store.mutate(insert_cards([new_card], mode, threshold))
+    if duplicates:
+        return jsonify({'error': 'Duplicate card', 'duplicate_of': duplicates[0]['duplicate_of']}), 409
     return jsonify(new_card)
 
+@app.route('/api/cards/batch', methods=['POST'])
+@login_required_conditional
+def batch_cards():
+    """Apply create/update/delete/move/reset ops in one commit, all or nothing.
+
+    Body: {"ops": [{"op": "create", "card": {...}}, {"op": "update", "id": ..., "fields": {...}},
+    {"op": "delete", "id": ...}, {"op": "move", "id": ..., "deck_id": ...}, {"op": "reset", "id": ...}]}
+    """
+    data = request.get_json(silent=True) or {}
+    ops = data.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': "'ops' must be a non-empty list"}), 400
+    max_ops = get_config().get('batch_max_ops', 10000)
+    if len(ops) > max_ops:
+        return jsonify({'error': f'At most {max_ops} ops per batch'}), 400
+    deck_ids = {deck['id'] for deck in get_decks()}
+    ok, results = store.mutate(apply_batch(ops, deck_ids))
+    if not ok:
+        return jsonify({'error': 'No changes were applied', 'results': results}), 400
+    return jsonify({'results': results})
+
+@app.route('/api/duplicates', methods=['GET'])
+@login_required_conditional
+def list_duplicates():
+    """Clusters of duplicate cards across decks (or in ?deck_id=), largest first.
+
+    ?mode=exact only groups cards whose normalized question and answer are
+    equal; the default 'near' also groups cards whose character shingles
+    overlap by at least ?threshold= (Jaccard, default 0.8).
+    """
+    mode = request.args.get('mode', 'near')
+    try:
+        if mode not in DUPLICATE_MODES:
+            raise ValueError(f"mode must be one of: {', '.join(DUPLICATE_MODES)}")
+        _, threshold = duplicate_args(request.args)
+        limit, after_id, fields = card_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(limit or 50, 500)
+    # Clusters are identified by their smallest card id; cards are only looked up for the page
+    clusters = [{'id': ids[0], 'ids': ids, 'exact': exact}
+                for ids, exact in store.duplicate_clusters(request.args.get('deck_id'), mode == 'near', threshold)]
+    try:
+        page, next_after_id = paginate(clusters, limit, after_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown after_id'}), 400
+    items = []
+    for cluster in page:
+        cards = [card for card in map(store.get_card, cluster['ids']) if card is not None]
+        if len(cards) < 2:
+            continue
+        items.append({'id': cluster['id'], 'kind': 'exact' if cluster['exact'] else 'near', 'size': len(cards),
+                      'keep': max(cards, key=review_rank)['id'], 'cards': [project(card, fields) for card in cards]})
+    return jsonify({'clusters': items, 'total': len(clusters),
+                    'duplicate_cards': sum(len(cluster['ids']) - 1 for cluster in clusters),
+                    'next_after_id': next_after_id})
+
+@app.route('/api/duplicates/merge', methods=['POST'])
+@login_required_conditional
+def merge_duplicates():
+    """Merge duplicate clusters into one card each, all or nothing.
+
+    Body: {"clusters": [[id, ...], {"ids": [...], "keep": id}, ...]}, or
+    {"all": "exact" | "near", "deck_id": ..., "threshold": ...} to merge every
+    cluster GET /api/duplicates would list. The kept card (by default the one
+    furthest along in its reviews) takes the most advanced review state in
+    its cluster; the others are deleted.
+    """
+    data = request.get_json(silent=True) or {}
+    clusters = data.get('clusters')
+    if data.get('all'):
+        if data['all'] not in DUPLICATE_MODES:
+            return jsonify({'error': f"'all' must be one of: {', '.join(DUPLICATE_MODES)}"}), 400
+        try:
+            _, threshold = duplicate_args(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        clusters = [ids for ids, exact in store.duplicate_clusters(data.get('deck_id'), data['all'] == 'near', threshold)]
+    elif not isinstance(clusters, list) or not clusters:
+        return jsonify({'error': "'clusters' must be a non-empty list, or set 'all'"}), 400
+    ok, results = store.mutate(merge_clusters(clusters))
+    if not ok:
+        return jsonify({'error': 'No changes were applied', 'results': results}), 400
+    return jsonify({'merged': len(results), 'deleted': sum(len(result['deleted']) for result in results),
+                    'results': results})
+
 @app.route('/api/cards/<card_id>', methods=['GET'])
 @login_required_conditional
 def get_card(card_id):
-    cards = get_cards()
-    card = next((c for c in cards if c['id'] == card_id), None)
+    card = store.get_card(card_id)
     if not card:
         return jsonify({'error': 'Card not found'}), 404
     return jsonify(card)
@@ -206,23 +529,21 @@ def get_card(card_id):
 @app.route('/api/cards/<card_id>', methods=['PUT'])
 @login_required_conditional
 def update_card(card_id):
-    cards = get_cards()
-    card = next((c for c in cards if c['id'] == card_id), None)
+    data = request.get_json()
+
+    def apply_edit(card):
+        card['question'] = data.get('question', card['question'])
+        card['answer'] = data.get('answer', card['answer'])
+
+    card = store.update_card(card_id, apply_edit)
     if not card:
         return jsonify({'error': 'Card not found'}), 404
-
-    data = request.get_json()
-    card['question'] = data.get('question', card['question'])
-    card['answer'] = data.get('answer', card['answer'])
-    save_cards(cards)
     return jsonify(card)
 
 @app.route('/api/cards/<card_id>', methods=['DELETE'])
 @login_required_conditional
 def delete_card(card_id):
-    cards = get_cards()
-    cards = [c for c in cards if c['id'] != card_id]
-    save_cards(cards)
+    store.delete_card(card_id)
     return jsonify({'message': 'Card deleted'})
 
 @app.route('/api/import', methods=['POST'])
@@ -233,19 +554,32 @@ def import_cards():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-    if file and file.filename.endswith('.json'):
-        new_cards = json.load(file)
+    if file and file.filename.lower().endswith(IMPORT_FORMATS):
         deck_id = request.form.get('deck_id')
-        for card in new_cards:
-            card['id'] = str(random.randint(1000, 9999))
-            card['due_date'] = datetime.now().isoformat()
-            card['interval'] = 0
-            if deck_id:
-                card['deck_id'] = deck_id
-        cards = get_cards()
-        cards.extend(new_cards)
-        save_cards(cards)
-        return jsonify({'message': f'{len(new_cards)} cards imported successfully'})
+        # The upload is parsed as a stream. Row-level stores commit it in
+        # batches so the write lock is never held long; the JSON store
+        # rewrites the whole file per commit, so it gets a single write
+        batch_size = get_config().get('import_batch_size', 1000) if store.store.row_level else None
+        # Duplicates within the deck are always skipped; skip_duplicates extends that to
+        # the whole collection ('exact') and to near-duplicates ('near')
+        try:
+            mode, threshold = duplicate_args(request.form)
+            if mode:
+                store.prepare_duplicates()
+            report = import_stream(file.stream, file.filename, deck_id, get_cards(deck_id),
+                                   lambda batch: len(store.mutate(insert_cards(batch, mode, threshold))[0]),
+                                   batch_size)
+        except (ImportFormatError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        if 'error' in report:
+            # Malformed partway through: say how much of it made it in before the error
+            report['message'] = f"Import stopped: {report['error']}. {report['imported']} cards were imported before it."
+            return jsonify(report), 400
+        message = f"{report['imported']} cards imported successfully"
+        if report['duplicates'] or report['skipped']:
+            message += f" ({report['duplicates']} duplicates, {report['skipped']} invalid entries skipped)"
+        report['message'] = message
+        return jsonify(report)
     return jsonify({'error': 'Invalid file format'}), 400
 
 @app.route('/api/quiz', methods=['GET'])
@@ -253,18 +587,29 @@ def import_cards():
 def get_quiz():
     deck_id = request.args.get('deck_id')
     quiz_type = request.args.get('quiz_type', 'long-answer')
+    # 'hard' picks wrong answers that look like the right one instead of random ones
+    hard_distractors = request.args.get('distractors') == 'hard'
+    fields = card_fields()
     cards = get_cards(deck_id)
-    random.shuffle(cards)
     config = get_config()
-    num_questions = int(request.args.get('num_questions', config.get('quiz_questions', 10)))
-    
+    try:
+        num_questions = int(request.args.get('num_questions', config.get('quiz_questions', 10)))
+        if num_questions < 0:
+            raise ValueError(num_questions)
+    except ValueError:
+        return jsonify({'error': 'num_questions must be a whole number, 0 or more'}), 400
+    quiz_cards = random.sample(cards, min(num_questions, len(cards)))
+    if quiz_type == 'multiple-choice':
+        deck_answers = distractor_engine.for_deck(deck_id, store.version, lambda: cards)
+
     questions = []
-    for card in cards[:min(num_questions, len(cards))]:
+    for card in quiz_cards:
         if quiz_type == 'multiple-choice':
             options = [card['answer']]
-            wrong_answers = [c['answer'] for c in cards if c['id'] != card['id']]
-            random.shuffle(wrong_answers)
-            options.extend(wrong_answers[:3])
+            if hard_distractors:
+                options.extend(deck_answers.similar(card['answer'], 3))
+            else:
+                options.extend(deck_answers.sample(card['answer'], 3))
             random.shuffle(options)
             questions.append({
                 'question': card['question'],
@@ -272,8 +617,9 @@ def get_quiz():
                 'answer': card['answer']
             })
         else:
-            questions.append(card)
-            
+            # Scheduling fields aren't needed to run a quiz
+            questions.append(project(card, fields or ('id', 'question', 'answer')))
+
     return jsonify(questions)
 
 @app.route('/api/learn/data', methods=['GET'])
@@ -281,73 +627,166 @@ def get_quiz():
 def get_learning_data():
     deck_id = request.args.get('deck_id')
     if not deck_id:
-        print("Error: deck_id is missing for /api/learn/data")
+        log_event(logger, 'learn_data', level='warning', error='deck_id is missing')
         return jsonify({'error': 'Deck ID is required for learning data.'}), 400
+    try:
+        limit, after_id, fields = card_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    started = time.perf_counter()
     try:
-        all_cards_in_deck = get_cards(deck_id)
         config = get_config()
         new_cards_limit = config.get('new_cards_per_day', 20)
 
-        now = datetime.now()
-        
-        due_cards = []
-        for card in all_cards_in_deck:
-            # Ensure due_date exists and is a valid ISO format, fallback to now if not
-            card_due_date_str = card.get('due_date')
-            if card_due_date_str:
-                try:
-                    card_due_date = datetime.fromisoformat(card_due_date_str)
-                except ValueError:
-                    print(f"Warning: Malformed due_date for card {card.get('id')}: {card_due_date_str}. Using current time.")
-                    card_due_date = now
-            else:
-                card_due_date = now # If due_date is missing, consider it due now
-
-            if card_due_date <= now:
-                due_cards.append(card)
+        # Range query on the deck's due-time index; cards with a missing or
+        # malformed due_date are treated as due now
+        due_cards = store.due_cards(deck_id, datetime.now())
+        due_seconds = time.perf_counter() - started
 
         new_cards = [card for card in due_cards if card.get('interval', 0) == 0]
         review_cards = [card for card in due_cards if card.get('interval', 0) > 0]
 
-        random.shuffle(new_cards)
+        # The shuffle is seeded so that a paginated client sees the same
+        # order on every page; it passes the seed back with after_id
+        seed = request.args.get('seed', type=int)
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+        rng = random.Random(seed)
+
+        rng.shuffle(new_cards)
         limited_new_cards = new_cards[:new_cards_limit]
 
         learn_queue = limited_new_cards + review_cards
-        random.shuffle(learn_queue)
-        
-        return jsonify({
-            'learn_queue': learn_queue,
+        rng.shuffle(learn_queue)
+
+        try:
+            page, next_after_id = paginate(learn_queue, limit, after_id)
+        except KeyError:
+            return jsonify({'error': 'Unknown after_id'}), 400
+        counts = {
             'total_cards_in_queue': len(learn_queue),
             'new_cards_in_queue': len(limited_new_cards),
             'review_cards_in_queue': len(review_cards)
-        })
+        }
+        log_event(logger, 'learn_data', deck_id=deck_id, due=len(due_cards), page=len(page),
+                  due_query_seconds=round(due_seconds, 6), seconds=round(time.perf_counter() - started, 6), **counts)
+
+        if wants_ndjson():
+            headers = {'X-' + key.replace('_', '-').title(): str(value) for key, value in counts.items()}
+            headers.update({'X-Seed': str(seed), 'X-Next-After-Id': next_after_id or ''})
+            return ndjson_response((project(card, fields) for card in page), headers)
+        return jsonify(dict(counts, learn_queue=[project(card, fields) for card in page], seed=seed, next_after_id=next_after_id))
     except Exception as e:
-        print(f"Error in get_learning_data: {e}")
+        log_event(logger, 'learn_data', level='exception', deck_id=deck_id, error=str(e))
         return jsonify({'error': f'An internal server error occurred: {str(e)}'}), 500
 
 @app.route('/api/learn/cards/<card_id>/answer', methods=['POST'])
 @login_required_conditional
 def answer_card(card_id):
-    cards = get_cards()
-    card = next((c for c in cards if c['id'] == card_id), None)
+    rating = request.json.get('rating')
+    if rating not in RATINGS:
+        return jsonify({'error': f"rating must be one of: {', '.join(RATINGS)}"}), 400
+
+    scheduler = get_scheduler(get_config())
+    now = datetime.now()
+    event_id = new_id()
+
+    # Runs under the store's write lock, so concurrent answers can't overwrite each other
+    def apply_rating(card):
+        scheduler.review(card, rating, now)
+        card['last_review_id'] = event_id
+
+    card = store.update_card(card_id, apply_rating)
     if not card:
         return jsonify({'error': 'Card not found'}), 404
-
-    rating = request.json.get('rating')
-    if rating == 'again':
-        card['interval'] = 0
-        card['due_date'] = datetime.now().isoformat() # Make it immediately due
-    elif rating == 'good':
-        card['interval'] = max(1, card.get('interval', 0) * 2)
-        card['due_date'] = (datetime.now() + timedelta(days=card['interval'])).isoformat()
-    elif rating == 'easy':
-        card['interval'] = max(1, card.get('interval', 0) * 4)
-        card['due_date'] = (datetime.now() + timedelta(days=card['interval'])).isoformat()
-
-    save_cards(cards)
+    review_log.append([{'event_id': event_id, 'card_id': card_id, 'rating': rating, 'reviewed_at': now.isoformat()}])
     return jsonify(card)
 
+@app.route('/api/learn/sync', methods=['POST'])
+@login_required_conditional
+def sync_reviews():
+    """Apply a batch of review events recorded offline by the client, in one commit.
+
+    Body: {"events": [{"event_id", "card_id", "rating", "reviewed_at"}, ...]}.
+    Safe to retry: events already applied (or older than a card's last
+    review) are counted as duplicate_or_stale and change nothing.
+    """
+    data = request.get_json(silent=True) or {}
+    events = data.get('events')
+    if not isinstance(events, list):
+        return jsonify({'error': "'events' must be a list"}), 400
+    max_events = get_config().get('sync_max_events', 5000)
+    if len(events) > max_events:
+        return jsonify({'error': f'At most {max_events} events per request'}), 400
+    if not events:
+        return jsonify({'applied': 0, 'duplicate_or_stale': 0, 'unknown_card': 0, 'rejected': []})
+    applied = []
+    summary = store.mutate(apply_review_events(events, datetime.now(), get_scheduler(get_config()), applied))
+    review_log.append(applied)
+    return jsonify(summary)
+
+def reschedule(deck_id=None):
+    """Recompute due dates for a deck (or every card) under the configured scheduler, in one commit."""
+    scheduler = get_scheduler(get_config())
+
+    def apply(index):
+        changed = reschedule_cards(index.cards(deck_id), scheduler)
+        index.put_many(changed)
+        return len(changed), changed, ()
+
+    started = time.perf_counter()
+    count = store.mutate(apply)
+    return {'scheduler': scheduler.name, 'rescheduled': count, 'seconds': round(time.perf_counter() - started, 3)}
+
+@app.route('/api/scheduler', methods=['GET'])
+@login_required_conditional
+def get_scheduler_settings():
+    config = get_config()
+    return jsonify({
+        'scheduler': config.get('scheduler', 'doubling'),
+        'available': list(SCHEDULERS),
+        'params': config.get('scheduler_params') or {},
+        'vectorized': scheduling.numpy is not None,
+    })
+
+@app.route('/api/scheduler', methods=['POST'])
+@login_required_conditional
+def set_scheduler():
+    """Switch algorithm and/or its params, then (by default) reschedule every card under it."""
+    data = request.get_json(silent=True) or {}
+    config = get_config()
+    name = data.get('scheduler', config.get('scheduler', 'doubling'))
+    if name not in SCHEDULERS:
+        return jsonify({'error': f"Unknown scheduler: {name}. Choose one of: {', '.join(SCHEDULERS)}"}), 400
+    config['scheduler'] = name
+    if isinstance(data.get('params'), dict):
+        config['scheduler_params'] = dict(config.get('scheduler_params') or {}, **{name: data['params']})
+    save_config(config)
+    result = reschedule() if data.get('reschedule', True) else {'scheduler': name, 'rescheduled': 0}
+    return jsonify(result)
+
+@app.route('/api/deck/<deck_id>/reschedule', methods=['POST'])
+@login_required_conditional
+def reschedule_deck(deck_id):
+    return jsonify(reschedule(deck_id))
+
+@app.route('/api/scheduler/optimize', methods=['POST'])
+@login_required_conditional
+def optimize_scheduler():
+    """Fit FSRS parameters to the review log; with "apply": true, save them and reschedule."""
+    data = request.get_json(silent=True) or {}
+    config = get_config()
+    params = (config.get('scheduler_params') or {}).get('fsrs') or {}
+    weights, report = optimize_fsrs(review_log, params.get('weights'), data.get('min_samples', 20))
+    result = {'weights': weights, 'report': report}
+    if data.get('apply'):
+        config['scheduler_params'] = dict(config.get('scheduler_params') or {}, fsrs=dict(params, weights=weights))
+        save_config(config)
+        if config.get('scheduler') == 'fsrs':
+            result['reschedule'] = reschedule()
+    return jsonify(result)
+
 @app.route('/api/settings', methods=['GET'])
 @login_required_conditional
 def get_settings():
@@ -371,48 +810,218 @@ def update_settings():
     save_config(config)
     return jsonify(config)
 
-@app.route('/api/generate-cards', methods=['POST'])
-@login_required_conditional
-def generate_cards():
-    data = request.get_json()
-    topic = data.get('topic')
-    deck_id = data.get('deck_id')
-    
-    log = "Generating cards from AI...\n"
-    config = get_config()
-    if not config.get('gemini_api_key'):
+def submit_job(kind, fn, *args):
+    try:
+        job = job_queue.submit(kind, fn, *args)
+    except QueueFull:
+        return jsonify({'error': 'Too many AI jobs are queued, please try again shortly.'}), 503
+    body = job.to_dict()
+    body['status_url'] = url_for('get_job', job_id=job.id)
+    return jsonify(body), 202
+
+def missing_api_key(config, log):
+    if needs_api_key(config) and not config.get('gemini_api_key'):
         log += "Error: Gemini API key is not set.\n"
         return jsonify({'error': 'Gemini API key is not set.', 'log': log}), 400
+    return None
+
+def response_cache_key(config, template, input_digest, quiz_type=None):
+    return DiskCache.key('response', config.get('gemini_backend', 'google'), config.get('gemini_model'),
+                         template, input_digest, quiz_type)
+
+def generate_json(job, config, prompt, cache_key, what, check_cache=True, label=None, batch=False):
+    """Ask Gemini for JSON, reusing a cached response for the same inputs.
+
+    Only responses that parse are cached, so a bad answer is retried next time.
+    Pass check_cache=False when the caller has already looked the key up.
+    With a `label`, that is logged instead of the (possibly very long) prompt.
+    With `batch`, a short prompt may share one call with other jobs' prompts.
+    """
+    job.progress(f"{label}: {len(prompt)} character prompt" if label else f"Prompt: {prompt}")
+    text = ai_cache.get(cache_key) if cache_key and check_cache else None
+    if text is not None:
+        job.progress("Response cache: hit")
+    else:
+        if cache_key:
+            job.progress("Response cache: miss")
+        backend = config.get('gemini_backend', 'google')
+        started = time.perf_counter()
+        try:
+            text = get_client(config).generate(prompt, batch, job.check_cancelled)
+        except Exception:
+            gemini_errors.inc(backend=backend, reason='exception')
+            raise
+        finally:
+            gemini_seconds.observe(time.perf_counter() - started, backend=backend)
+    job.progress(f"Gemini Response: {text}")
 
-    genai.configure(api_key=config['gemini_api_key'])
-    model = genai.GenerativeModel(config['gemini_model'])
-    
-    prompt = f"Generate 5 flashcards about {topic} in JSON format with 'question' and 'answer' keys."
-    log += f"Prompt: {prompt}\n"
-    
-    response = model.generate_content(prompt)
-    log += f"Gemini Response: {response.text}\n"
-    
     try:
-        json_text = extract_json_from_markdown(response.text)
-        new_cards = json.loads(json_text)
-        log += "Successfully generated cards.\n"
+        result = json.loads(extract_json_from_markdown(text))
     except (json.JSONDecodeError, TypeError):
-        log += "Error: Failed to generate cards from Gemini API.\n"
-        return jsonify({'error': 'Failed to generate cards from Gemini API.', 'log': log}), 500
+        gemini_errors.inc(backend=config.get('gemini_backend', 'google'), reason='unparseable')
+        job.progress(f"Error: Failed to generate {what} from Gemini API.")
+        raise JobError(f'Failed to generate {what} from Gemini API.')
+    if cache_key:
+        ai_cache.set(cache_key, text)
+    job.progress(f"Successfully generated {what}.")
+    return result
+
+def run_generate_cards(job, config, topic, deck_id, use_cache=False, skip_duplicates=None):
+    job.progress("Generating cards from AI...")
+    prompt = f"Generate 5 flashcards about {topic} in JSON format with 'question' and 'answer' keys."
+    cache_key = response_cache_key(config, 'generate-cards', digest(topic or '')) if use_cache else None
+    new_cards = generate_json(job, config, prompt, cache_key, 'cards', batch=True)
 
     for card in new_cards:
         card['deck_id'] = deck_id
-        card['id'] = str(random.randint(1000, 9999))
+        card['id'] = new_id()
         card['due_date'] = datetime.now().isoformat()
         card['interval'] = 0
-        
-    cards = get_cards()
-    cards.extend(new_cards)
-    save_cards(cards)
-    
-    log += f"{len(new_cards)} cards added to the deck."
-    return jsonify({'cards': new_cards, 'log': log})
+
+    if skip_duplicates:
+        store.prepare_duplicates()
+    new_cards, duplicates = store.mutate(insert_cards(new_cards, skip_duplicates, config.get('dedup_threshold', SIMILARITY)))
+
+    job.progress(f"{len(new_cards)} cards added to the deck.")
+    if duplicates:
+        job.progress(f"{len(duplicates)} duplicate cards skipped.")
+    return {'cards': new_cards, 'log': '\n'.join(job.log)}
+
+def pdf_quiz_prompt(text, quiz_type, num_questions=5):
+    if quiz_type == 'multiple-choice':
+        return f"Based on the following text, generate a quiz with {num_questions} multiple choice questions in JSON format. Each question should have 'question', 'options' (an array of 4 strings), and 'answer' keys:\n\n{text}"
+    return f"Based on the following text, generate a quiz with {num_questions} long answer questions in JSON format with 'question' and 'answer' keys:\n\n{text}"
+
+def read_pdf_pages(pdf_bytes, workers, collected):
+    """Page texts from the PDF; also appended to `collected` so they can be cached."""
+    try:
+        for page in extract_pages(pdf_bytes, workers):
+            collected.append(page)
+            yield page
+    except Exception as e:
+        raise JobError(f"Error reading PDF: {e}")
+
+def save_questions_as_cards(questions, deck_id):
+    existing = {content_key(card.get('question'), card.get('answer')) for card in get_cards(deck_id)}
+    new_cards = []
+    for question in questions:
+        answer = question.get('answer')
+        if not answer or content_key(question['question'], answer) in existing:
+            continue
+        existing.add(content_key(question['question'], answer))
+        new_cards.append({
+            'question': question['question'],
+            'answer': answer,
+            'deck_id': deck_id,
+            'id': new_id(),
+            'due_date': datetime.now().isoformat(),
+            'interval': 0,
+        })
+    store.put_cards(new_cards)
+    return len(new_cards)
+
+def run_quiz_from_pdf(job, config, pdf_bytes, quiz_type, questions_per_chunk=5, deck_id=None):
+    """Pages are extracted in parallel, grouped into token-bounded chunks and
+    sent to Gemini a few chunks at a time; the questions are then merged and
+    deduplicated, and optionally saved as cards in `deck_id`."""
+    job.progress("Creating quiz from PDF...")
+    pdf_digest = digest(pdf_bytes)
+    chunk_tokens = config.get('pdf_chunk_tokens', 8000)
+    cache_key = response_cache_key(config, 'quiz-from-pdf', f'{pdf_digest}:{chunk_tokens}:{questions_per_chunk}', quiz_type)
+    timings = {}
+
+    # Same document and settings as before: skip both parsing and Gemini
+    cached = ai_cache.get(cache_key)
+    if cached is not None:
+        job.progress("Response cache: hit")
+        quiz = json.loads(cached)
+    else:
+        text_key = DiskCache.key('pdf-text', pdf_digest)
+        cached_text = ai_cache.get(text_key)
+        collected = []
+        if cached_text is not None:
+            job.progress("PDF text cache: hit")
+            pages = cached_text.split('\f')
+        else:
+            job.progress("PDF text cache: miss")
+            pages = read_pdf_pages(pdf_bytes, config.get('pdf_workers'), collected)
+
+        failed_chunks = []
+
+        def generate_chunk(text, index):
+            key = response_cache_key(config, 'quiz-from-pdf-chunk', digest(text), f'{quiz_type}:{questions_per_chunk}')
+            try:
+                questions = generate_json(job, config, pdf_quiz_prompt(text, quiz_type, questions_per_chunk), key, 'quiz',
+                                          label=f"Chunk {index + 1}")
+            except JobError as e:
+                # One unparseable answer shouldn't throw away every other chunk's questions
+                job.progress(f"Chunk {index + 1} skipped: {e}")
+                failed_chunks.append(index)
+                return []
+            return questions if isinstance(questions, list) else []
+
+        quiz, timer = ingest(pages, generate_chunk, chunk_tokens, config.get('pdf_max_concurrency', 2), job.progress)
+        if failed_chunks and not quiz:
+            raise JobError('Failed to generate quiz from Gemini API.')
+        timings = timer.rounded()
+        if cached_text is None:
+            job.progress(f"Successfully extracted text from {len(collected)} PDF pages.")
+            ai_cache.set(text_key, '\f'.join(collected))
+        # A partial quiz isn't cached as the document's answer; the good chunks are cached on their own
+        if not failed_chunks:
+            ai_cache.set(cache_key, json.dumps(quiz, ensure_ascii=False))
+        else:
+            job.progress(f"{len(failed_chunks)} chunks failed; their questions are missing from the quiz.")
+    job.progress(f"Successfully generated quiz with {len(quiz)} questions.")
+
+    result = {'quiz': quiz, 'timings': timings}
+    if deck_id:
+        persist_started = time.perf_counter()
+        result['cards_added'] = save_questions_as_cards(quiz, deck_id)
+        timings['persist'] = round(time.perf_counter() - persist_started, 3)
+        job.progress(f"{result['cards_added']} questions saved as cards in the deck.")
+    job.progress(f"Timings (seconds): {json.dumps(timings)}")
+    result['log'] = '\n'.join(job.log)
+    return result
+
+def run_quiz_from_flashcards(job, config, cards, quiz_type):
+    job.progress("Generating quiz from flashcards...")
+    # Only questions and answers go in the prompt, sampled down to the token budget if the deck is large
+    card_str, used = cards_for_prompt(cards, config.get('quiz_prompt_tokens', 8000), config.get('quiz_field_chars', 400),
+                                      seed=digest(''.join(str(card.get('id')) for card in cards)))
+    if used < len(cards):
+        job.progress(f"Using a sample of {used} of the deck's {len(cards)} cards.")
+
+    if quiz_type == 'multiple-choice':
+        prompt = f"Based on the following flashcards, generate a quiz with 5 multiple choice questions in JSON format. Each question should have 'question', 'options' (an array of 4 strings), and 'answer' keys:\n\n{card_str}"
+    else:
+        prompt = f"Based on the following flashcards, generate a quiz with 5 long answer questions in JSON format with 'question' and 'answer' keys:\n\n{card_str}"
+    cache_key = response_cache_key(config, 'quiz-from-flashcards', digest(card_str), quiz_type)
+    quiz = generate_json(job, config, prompt, cache_key, 'quiz')
+    return {'quiz': quiz, 'log': '\n'.join(job.log)}
+
+# The AI endpoints below only validate input and queue a background job;
+# clients poll /api/jobs/<job_id> (or listen on its /events stream) for the result.
+
+@app.route('/api/generate-cards', methods=['POST'])
+@login_required_conditional
+def generate_cards():
+    data = request.get_json()
+    topic = data.get('topic')
+    deck_id = data.get('deck_id')
+
+    skip_duplicates = data.get('skip_duplicates') or None
+    if skip_duplicates is not None and skip_duplicates not in DUPLICATE_MODES:
+        return jsonify({'error': f"skip_duplicates must be one of: {', '.join(DUPLICATE_MODES)}"}), 400
+
+    config = get_config()
+    error = missing_api_key(config, "Generating cards from AI...\n")
+    if error:
+        return error
+    # Each request should add new cards, so the response cache is opt-in here: a hit
+    # would add the same cards again. 'use_cache' is for callers that want that
+    return submit_job('generate-cards', run_generate_cards, config, topic, deck_id, bool(data.get('use_cache')),
+                      skip_duplicates)
 
 @app.route('/api/create-quiz-from-pdf', methods=['POST'])
 @login_required_conditional
@@ -423,106 +1032,127 @@ def create_quiz_from_pdf():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    log = "Creating quiz from PDF...\n"
-    try:
-        pdf_reader = PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        log += "Successfully extracted text from PDF.\n"
-    except Exception as e:
-        log += f"Error reading PDF: {e}\n"
-        return jsonify({'error': f"Error reading PDF: {e}", 'log': log}), 500
-
     config = get_config()
-    if not config.get('gemini_api_key'):
-        log += "Error: Gemini API key is not set.\n"
-        return jsonify({'error': 'Gemini API key is not set.', 'log': log}), 400
-        
+    error = missing_api_key(config, "Creating quiz from PDF...\n")
+    if error:
+        return error
     quiz_type = request.form.get('quiz_type', 'multiple-choice')
-    genai.configure(api_key=config['gemini_api_key'])
-    model = genai.GenerativeModel(config['gemini_model'])
-
-    if quiz_type == 'multiple-choice':
-        prompt = f"Based on the following text, generate a quiz with 5 multiple choice questions in JSON format. Each question should have 'question', 'options' (an array of 4 strings), and 'answer' keys:\n\n{text}"
-    else:
-        prompt = f"Based on the following text, generate a quiz with 5 long answer questions in JSON format with 'question' and 'answer' keys:\n\n{text}"
-    
-    log += f"Prompt: {prompt}\n"
-    response = model.generate_content(prompt)
-    log += f"Gemini Response: {response.text}\n"
-
-    try:
-        json_text = extract_json_from_markdown(response.text)
-        quiz = json.loads(json_text)
-        log += "Successfully generated quiz.\n"
-    except (json.JSONDecodeError, TypeError):
-        log += "Error: Failed to generate quiz from Gemini API.\n"
-        return jsonify({'error': 'Failed to generate quiz from Gemini API.', 'log': log}), 500
-
-    return jsonify({'quiz': quiz, 'log': log})
+    questions_per_chunk = min(max(request.form.get('questions_per_chunk', 5, type=int), 1), 20)
+    # With save_to_deck, the generated questions are also added as cards to deck_id
+    deck_id = request.form.get('deck_id') if request.form.get('save_to_deck') in ('1', 'true', 'on') else None
+    return submit_job('quiz-from-pdf', run_quiz_from_pdf, config, file.read(), quiz_type, questions_per_chunk, deck_id)
 
 @app.route('/api/generate-quiz-from-flashcards', methods=['GET'])
 @login_required_conditional
 def generate_quiz_from_flashcards():
     deck_id = request.args.get('deck_id')
     cards = get_cards(deck_id)
-    
-    log = "Generating quiz from flashcards...\n"
-    config = get_config()
-    if not config.get('gemini_api_key'):
-        log += "Error: Gemini API key is not set.\n"
-        return jsonify({'error': 'Gemini API key is not set.', 'log': log}), 400
 
-    genai.configure(api_key=config['gemini_api_key'])
-    model = genai.GenerativeModel(config['gemini_model'])
-    
+    config = get_config()
+    error = missing_api_key(config, "Generating quiz from flashcards...\n")
+    if error:
+        return error
     quiz_type = request.args.get('quiz_type', 'multiple-choice')
-    card_str = json.dumps(cards)
+    return submit_job('quiz-from-flashcards', run_quiz_from_flashcards, config, cards, quiz_type)
 
-    if quiz_type == 'multiple-choice':
-        prompt = f"Based on the following flashcards, generate a quiz with 5 multiple choice questions in JSON format. Each question should have 'question', 'options' (an array of 4 strings), and 'answer' keys:\n\n{card_str}"
-    else:
-        prompt = f"Based on the following flashcards, generate a quiz with 5 long answer questions in JSON format with 'question' and 'answer' keys:\n\n{card_str}"
-    
-    log += f"Prompt: {prompt}\n"
-    response = model.generate_content(prompt)
-    log += f"Gemini Response: {response.text}\n"
-    
-    try:
-        json_text = extract_json_from_markdown(response.text)
-        quiz = json.loads(json_text)
-        log += "Successfully generated quiz.\n"
-    except (json.JSONDecodeError, TypeError):
-        log += "Error: Failed to generate quiz from Gemini API.\n"
-        return jsonify({'error': 'Failed to generate quiz from Gemini API.', 'log': log}), 500
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required_conditional
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
 
-    return jsonify({'quiz': quiz, 'log': log})
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@login_required_conditional
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@login_required_conditional
+def job_events(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    # Server-sent events: one 'progress' event per change, then a final 'done'
+    def generate():
+        version = None
+        while True:
+            if version == job.version:
+                yield ": keep-alive\n\n"
+            else:
+                version = job.version
+                event = 'done' if job.done else 'progress'
+                yield f"event: {event}\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                if job.done:
+                    return
+            job_queue.wait(job, version, timeout=15)
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/deck/<deck_id>/stats', methods=['GET'])
 @login_required_conditional
 def get_deck_stats(deck_id):
-    cards = get_cards(deck_id)
-    total_cards = len(cards)
-    new_cards = 0
-    learning_cards = 0
-    mature_cards = 0
-
-    for card in cards:
-        interval = card.get('interval', 0)
-        if interval == 0:
-            new_cards += 1
-        elif 0 < interval < 21:
-            learning_cards += 1
-        else:
-            mature_cards += 1
-            
-    return jsonify({
-        'total_cards': total_cards,
-        'to_learn_count': new_cards,
-        'learning_count': learning_cards,
-        'mastered_count': mature_cards
-    })
+    # Counters kept up to date by the card index on every write; no scan of the deck
+    now = datetime.now()
+    stats = store.deck_stats(deck_id, now)
+    body = {
+        'total_cards': stats['total'],
+        'to_learn_count': stats['new'],
+        'learning_count': stats['learning'],
+        'mastered_count': stats['mature'],
+        'due_today': stats['due_today'],
+    }
+    if request.args.get('verify') == '1':
+        # Recount from scratch and report whether the counters agree
+        cards = get_cards(deck_id)
+        recomputed = count_stats(cards)
+        end_of_today = day_starts(now, 1)[0]
+        recomputed['due_today'] = sum(1 for card in cards if due_timestamp(card) < end_of_today)
+        body['recomputed'] = recomputed
+        body['verified'] = recomputed == stats
+    return jsonify(body)
+
+@app.route('/api/deck/<deck_id>/forecast', methods=['GET'])
+@login_required_conditional
+def get_deck_forecast(deck_id):
+    days = max(1, min(request.args.get('days', 30, type=int), 365))
+    today = datetime.now().date()
+    counts = store.forecast(deck_id, days=days)
+    # Day 0 (today) includes cards that are already overdue
+    return jsonify({'forecast': [{'date': (today + timedelta(days=i)).isoformat(), 'due': count}
+                                 for i, count in enumerate(counts)]})
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required_conditional
+def get_cache_stats():
+    return jsonify({'cards': store.stats(), 'config': config_cache.stats(), 'ai': ai_cache.stats()})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the worker is up and answering requests
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: the card index is loaded (loading it now if needed) and the store can be read
+    try:
+        store.warm()
+        decks = store.get_decks()
+    except Exception as e:
+        logger.exception('Readiness check failed')
+        return jsonify({'status': 'unavailable', 'error': f'{type(e).__name__}: {e}'}), 503
+    return jsonify({'status': 'ready', 'pid': os.getpid(), 'decks': len(decks), 'cache_version': store.version})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Left open for Prometheus scrapers; set "metrics_enabled": false to turn it off
+    if not get_config().get('metrics_enabled', True):
+        return jsonify({'error': 'Not found'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -533,5 +1163,7 @@ def index():
     return render_template('index.html', disable_google_login=disable_login)
 
 if __name__ == '__main__':
+    # Development server; see gunicorn.conf.py for production
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
     port = int(os.environ.get('PORT', 5001))
-    app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
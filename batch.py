@@ -0,0 +1,100 @@
+from datetime import datetime
+
+from store import new_id
+
+BATCH_OPS = ('create', 'update', 'delete', 'move', 'reset')
+EDITABLE_FIELDS = ('question', 'answer')
+
+
+def _error(i, op, message):
+    return {'index': i, 'op': op.get('op') if isinstance(op, dict) else None, 'status': 'error', 'error': message}
+
+
+def plan_batch(ops, index, deck_ids):
+    """Check every op against the index and work out the resulting cards.
+
+    Returns (results, pending) where pending maps card id -> new card dict,
+    or None for a deleted card. Nothing is touched: if any result is an
+    error the caller applies none of it. Later ops see the effect of
+    earlier ones in the same batch.
+    """
+    now = datetime.now().isoformat()
+    pending = {}
+    results = []
+
+    def lookup(card_id):
+        if card_id in pending:
+            return pending[card_id]
+        card = index.by_id.get(card_id)
+        return dict(card) if card is not None else None
+
+    for i, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get('op') not in BATCH_OPS:
+            results.append(_error(i, op, f"'op' must be one of: {', '.join(BATCH_OPS)}"))
+            continue
+        kind = op['op']
+        if kind == 'create':
+            card = op.get('card') or {}
+            if not card.get('question') or not card.get('answer'):
+                results.append(_error(i, op, 'create needs a card with a question and an answer'))
+                continue
+            if card.get('deck_id') not in deck_ids:
+                results.append(_error(i, op, f"Unknown deck_id: {card.get('deck_id')}"))
+                continue
+            card = dict(card, id=new_id(), due_date=now, interval=0)
+            pending[card['id']] = card
+            results.append({'index': i, 'op': kind, 'status': 'ok', 'id': card['id']})
+            continue
+
+        card = lookup(op.get('id'))
+        if card is None:
+            results.append(_error(i, op, f"Card not found: {op.get('id')}"))
+            continue
+        if kind == 'update':
+            fields = {key: value for key, value in (op.get('fields') or {}).items() if key in EDITABLE_FIELDS}
+            if not fields:
+                results.append(_error(i, op, f"update needs 'fields' with any of: {', '.join(EDITABLE_FIELDS)}"))
+                continue
+            card.update(fields)
+        elif kind == 'delete':
+            card = None
+        elif kind == 'move':
+            if op.get('deck_id') not in deck_ids:
+                results.append(_error(i, op, f"Unknown deck_id: {op.get('deck_id')}"))
+                continue
+            card['deck_id'] = op['deck_id']
+        elif kind == 'reset':
+            card['interval'] = 0
+            card['due_date'] = now
+            # Scheduler state too, so the next review starts from scratch
+            card.pop('srs', None)
+            card.pop('last_reviewed_at', None)
+        pending[op['id']] = card
+        results.append({'index': i, 'op': kind, 'status': 'ok', 'id': op['id']})
+    return results, pending
+
+
+def apply_batch(ops, deck_ids):
+    """An index function for CachedCardStore.mutate that applies the ops all or nothing.
+
+    Its result is (ok, per-op results). When any op fails, the valid ones
+    are reported as 'skipped'.
+    """
+    def apply(index):
+        results, pending = plan_batch(ops, index, deck_ids)
+        if any(result['status'] == 'error' for result in results):
+            for result in results:
+                if result['status'] == 'ok':
+                    result['status'] = 'skipped'
+            return (False, results), (), ()
+        changed = []
+        deleted = []
+        for card_id, card in pending.items():
+            if card is None:
+                if index.remove(card_id) is not None:
+                    deleted.append(card_id)
+            else:
+                index.put(card)
+                changed.append(card)
+        return (True, results), changed, deleted
+    return apply
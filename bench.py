@@ -0,0 +1,319 @@
+"""Benchmark the review API against synthetic collections.
+
+    python bench.py --sizes 1000,10000,100000 --requests 200
+    python bench.py --mode http --concurrency 8 --backend sqlite --out run.json
+    python bench.py --sizes 10000 --compare run.json
+
+Each collection size runs in its own subprocess against a temporary copy of
+the app's data files (cards.json in the usual schema, a fake Gemini
+backend, login disabled), so peak RSS is per size. Results are printed, and
+written with --out, as JSON; --compare prints latency ratios against an
+earlier results file.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+SCENARIOS = ('learn_data', 'answer', 'quiz', 'stats', 'import')
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+WORDS = ('graph', 'kernel', 'vector', 'latency', 'cache', 'schema', 'tensor', 'queue', 'شبکه', 'حافظه', 'الگوریتم', 'داده')
+
+
+def synthesize(directory, size, decks=4, backend='json'):
+    """Write decks.json/cards.json/config.json for a collection of `size` cards."""
+    rng = random.Random(size)
+    now = datetime.now()
+    deck_ids = [f'bench{i}' for i in range(decks)]
+    cards = []
+    for i in range(size):
+        interval = rng.choice((0, 0, 1, 2, 4, 8, 16, 32, 64))
+        due = now + timedelta(days=rng.randint(-10, interval or 1), seconds=rng.randint(0, 86399))
+        cards.append({
+            'question': f'{rng.choice(WORDS)} {rng.choice(WORDS)} #{i}',
+            'answer': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i % 997}',
+            'deck_id': deck_ids[i % decks],
+            'id': f'c{i}',
+            'interval': interval,
+            'due_date': due.isoformat(),
+        })
+    with open(os.path.join(directory, 'cards.json'), 'w') as f:
+        json.dump(cards, f, indent=4)
+    with open(os.path.join(directory, 'decks.json'), 'w') as f:
+        json.dump([{'name': deck_id, 'id': deck_id} for deck_id in deck_ids], f)
+    config = {
+        'quiz_questions': 10,
+        'new_cards_per_day': 20,
+        'gemini_backend': 'fake',
+        'gemini_api_key': '',
+        'gemini_model': 'fake',
+        'disable_google_login': True,
+        'card_store': backend,
+        'card_store_path': os.path.join(directory, 'cards.db'),
+    }
+    with open(os.path.join(directory, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    return deck_ids, [card['id'] for card in cards]
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {'p50_ms': pick(50), 'p95_ms': pick(95), 'p99_ms': pick(99), 'max_ms': round(ordered[-1] * 1000, 3)}
+
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.client = app.test_client()
+        self._local = threading.local()
+        self.app = app
+
+    def request(self, method, path, json_body=None, data=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=json_body, data=data)
+        return response.status_code
+
+
+class HttpDriver:
+    """Real HTTP against a threaded werkzeug server on an ephemeral port."""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._local = threading.local()
+
+    def request(self, method, path, json_body=None, data=None):
+        import http.client
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body, content_type = encode_multipart(data)
+            headers['Content-Type'] = content_type
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (ConnectionError, http.client.HTTPException):
+            self._local.conn = None
+            raise
+        return response.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+def encode_multipart(data):
+    boundary = f'bench{random.getrandbits(64):x}'
+    parts = []
+    for name, value in data.items():
+        if isinstance(value, tuple):
+            stream, filename = value
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                         f'Content-Type: application/octet-stream\r\n\r\n'.encode() + stream.read() + b'\r\n')
+        else:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def scenario_requests(name, deck_ids, card_ids, rng, import_size):
+    deck_id = rng.choice(deck_ids)
+    if name == 'learn_data':
+        return 'GET', f'/api/learn/data?deck_id={deck_id}', None, None
+    if name == 'answer':
+        return 'POST', f'/api/learn/cards/{rng.choice(card_ids)}/answer', {'rating': rng.choice(('again', 'good', 'easy'))}, None
+    if name == 'quiz':
+        return 'GET', f'/api/quiz?deck_id={deck_id}&quiz_type=multiple-choice', None, None
+    if name == 'stats':
+        return 'GET', f'/api/deck/{deck_id}/stats', None, None
+    if name == 'import':
+        tag = rng.getrandbits(48)
+        cards = [{'question': f'imported {tag} {i}', 'answer': f'answer {tag} {i}'} for i in range(import_size)]
+        upload = io.BytesIO(json.dumps(cards).encode('utf-8'))
+        return 'POST', '/api/import', None, {'deck_id': deck_id, 'file': (upload, 'bench.json')}
+    raise ValueError(name)
+
+
+def run_scenario(driver, name, deck_ids, card_ids, requests, concurrency, import_size):
+    rng = random.Random(name)
+    planned = [scenario_requests(name, deck_ids, card_ids, rng, import_size) for _ in range(requests)]
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(request):
+        nonlocal errors
+        method, path, json_body, data = request
+        started = time.perf_counter()
+        try:
+            status = driver.request(method, path, json_body=json_body, data=data)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if status is None or status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, planned))
+    else:
+        for request in planned:
+            one(request)
+    wall = time.perf_counter() - started
+    result = percentiles(latencies)
+    result.update({
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / wall, 1) if wall else None,
+        'wall_seconds': round(wall, 3),
+    })
+    return result
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+def run_size(args):
+    """Runs in the per-size subprocess: build the collection, import the app, drive it."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f'bench{args.size}-', ignore_cleanup_errors=True) as directory:
+        try:
+            return _run_size_in(directory, args)
+        finally:
+            # Out of the directory before it is removed
+            os.chdir(cwd)
+
+
+def _run_size_in(directory, args):
+    synth_started = time.perf_counter()
+    deck_ids, card_ids = synthesize(directory, args.size, backend=args.backend)
+    synth_seconds = time.perf_counter() - synth_started
+    os.chdir(directory)
+    sys.path.insert(0, APP_DIR)
+
+    started = time.perf_counter()
+    import app as flashcard_app
+    flask_app = flashcard_app.create_app()
+    import_seconds = time.perf_counter() - started
+
+    if args.mode == 'http':
+        driver = HttpDriver(flask_app)
+    else:
+        driver = TestClientDriver(flask_app)
+
+    try:
+        # The first read loads the collection into memory; time it separately
+        started = time.perf_counter()
+        driver.request('GET', f'/api/deck/{deck_ids[0]}/stats')
+        first_request_seconds = time.perf_counter() - started
+
+        results = {
+            'size': args.size,
+            'backend': args.backend,
+            'mode': args.mode,
+            'concurrency': args.concurrency,
+            'synthesize_seconds': round(synth_seconds, 3),
+            'app_import_seconds': round(import_seconds, 3),
+            'first_request_seconds': round(first_request_seconds, 3),
+            'scenarios': {},
+        }
+        for name in args.scenarios:
+            results['scenarios'][name] = run_scenario(driver, name, deck_ids, card_ids, args.requests,
+                                                      args.concurrency, args.import_size)
+    finally:
+        if args.mode == 'http':
+            driver.close()
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def compare(current, previous):
+    """Ratio of current to previous p50/p95/p99 per size and scenario (<1 is faster)."""
+    by_size = {run['size']: run for run in previous.get('runs', [])}
+    report = {}
+    for run in current['runs']:
+        old = by_size.get(run['size'])
+        if not old:
+            continue
+        for name, stats in run['scenarios'].items():
+            old_stats = old['scenarios'].get(name)
+            if not old_stats:
+                continue
+            report[f"{run['size']}/{name}"] = {
+                key: round(stats[key] / old_stats[key], 2) if old_stats.get(key) else None
+                for key in ('p50_ms', 'p95_ms', 'p99_ms')
+            }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated collection sizes (e.g. 1000,10000,100000,1000000)')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client', help="Flask test client or real HTTP")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--import-size', type=int, default=100, help='cards per /api/import request')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--out', help='write the results JSON here')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.scenarios = [name for name in args.scenarios.split(',') if name]
+
+    if args.size:
+        print(json.dumps(run_size(args)))
+        return
+
+    runs = []
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        command = [sys.executable, os.path.abspath(__file__), '--size', str(size), '--mode', args.mode,
+                   '--backend', args.backend, '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                   '--import-size', str(args.import_size), '--scenarios', ','.join(args.scenarios)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+        print(f"{size} cards done", file=sys.stderr)
+
+    results = {'created_at': datetime.now().isoformat(), 'python': sys.version.split()[0], 'runs': runs}
+    if args.compare:
+        with open(args.compare) as f:
+            results['comparison'] = compare(results, json.load(f))
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,541 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from dedup import SIMILARITY, DuplicateIndex
+from metrics import log_event
+from search import InvertedIndex
+from store import GroupCommitter, file_lock, file_stamp
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFileCache:
+    """Parsed JSON files, reloaded only when their mtime or size changes."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        stamp = file_stamp(path)
+        if stamp is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self._lock:
+            self._entries[path] = (stamp, data)
+        return data
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def due_timestamp(card):
+    """Epoch seconds of a card's due_date; missing or malformed dates count as due."""
+    due_date = card.get('due_date')
+    if not due_date:
+        return 0.0
+    try:
+        return datetime.fromisoformat(due_date).timestamp()
+    except (TypeError, ValueError):
+        log_event(logger, 'malformed_due_date', level='warning', card_id=card.get('id'), due_date=due_date)
+        return 0.0
+
+
+# Cards at or past this interval (days) count as mature, below it as learning
+MATURE_INTERVAL = 21
+STAT_CLASSES = ('new', 'learning', 'mature')
+
+
+def interval_class(card):
+    interval = card.get('interval') or 0
+    if interval == 0:
+        return 'new'
+    if interval < MATURE_INTERVAL:
+        return 'learning'
+    return 'mature'
+
+
+def day_starts(now, days):
+    """Local midnights from tomorrow onwards, as timestamps: the ends of `days` consecutive days."""
+    today = datetime(now.year, now.month, now.day)
+    return [(today + timedelta(days=i + 1)).timestamp() for i in range(days)]
+
+
+def count_stats(cards):
+    """Card counts per interval class, recomputed from scratch."""
+    counts = dict.fromkeys(('total',) + STAT_CLASSES, 0)
+    for card in cards:
+        counts['total'] += 1
+        counts[interval_class(card)] += 1
+    return counts
+
+
+class DueQueue:
+    """(due timestamp, card id) pairs for one deck, kept sorted."""
+
+    # Sorts after every card id, so a range query includes all cards due at `now`.
+    _MAX_ID = '\U0010ffff'
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, due_ts, card_id):
+        bisect.insort(self.entries, (due_ts, card_id))
+
+    def discard(self, due_ts, card_id):
+        i = bisect.bisect_left(self.entries, (due_ts, card_id))
+        if i < len(self.entries) and self.entries[i] == (due_ts, card_id):
+            del self.entries[i]
+
+    def due_ids(self, now_ts):
+        end = bisect.bisect_right(self.entries, (now_ts, self._MAX_ID))
+        return [card_id for _, card_id in self.entries[:end]]
+
+    def count_before(self, ts):
+        """Number of cards due strictly before `ts`."""
+        return bisect.bisect_left(self.entries, (ts,))
+
+
+class CardIndex:
+    """Cards keyed by id and partitioned by deck, in collection order.
+
+    Each deck also has a DueQueue, so the cards due by a given time come out
+    of a range query instead of parsing every due_date on each request, and
+    per-deck counts by interval class that are adjusted on every put/remove.
+    """
+
+    def __init__(self, cards=()):
+        self.by_id = {}
+        self.by_deck = {}
+        self.due = {}
+        self.counts = {}
+        self._due_ts = {}
+        # Built on the first search / duplicate lookup, then kept up to date like the rest
+        self._search = None
+        self._dedup = None
+        # deck_id -> (membership version, ids in deck order, id -> position) for cursor paging;
+        # rebuilt only after cards join or leave the deck
+        self._order = {}
+        self._members = {}
+        self.put_many(cards)
+
+    # Above this many cards, put_many re-sorts the affected due queues once
+    # instead of inserting into them one card at a time
+    BULK_PUT = 1000
+
+    def put(self, card, update_queue=True):
+        card_id = card['id']
+        deck_id = card.get('deck_id')
+        old = self.by_id.get(card_id)
+        if old is not None:
+            old_deck_id = old.get('deck_id')
+            if update_queue:
+                self.due[old_deck_id].discard(self._due_ts[card_id], card_id)
+            self._count(old, -1)
+            if old_deck_id != deck_id:
+                self.by_deck[old_deck_id].pop(card_id, None)
+                self._members[old_deck_id] = self._members.get(old_deck_id, 0) + 1
+        if old is None or old.get('deck_id') != deck_id:
+            self._members[deck_id] = self._members.get(deck_id, 0) + 1
+        due_ts = due_timestamp(card)
+        # Updating an existing key keeps its position in the collection.
+        self.by_id[card_id] = card
+        self.by_deck.setdefault(deck_id, {})[card_id] = card
+        if update_queue:
+            self.due.setdefault(deck_id, DueQueue()).add(due_ts, card_id)
+        self._due_ts[card_id] = due_ts
+        self._count(card, 1)
+        if self._search is not None:
+            self._search.add(card)
+        if self._dedup is not None:
+            self._dedup.add(card)
+
+    def put_many(self, cards):
+        cards = list(cards)
+        if len(cards) < self.BULK_PUT:
+            for card in cards:
+                self.put(card)
+            return
+        decks = set()
+        for card in cards:
+            old = self.by_id.get(card['id'])
+            if old is not None:
+                decks.add(old.get('deck_id'))
+            decks.add(card.get('deck_id'))
+            self.put(card, update_queue=False)
+        for deck_id in decks:
+            queue = self.due[deck_id] = DueQueue()
+            queue.entries = sorted((self._due_ts[card_id], card_id) for card_id in self.by_deck.get(deck_id, {}))
+
+    def _count(self, card, delta):
+        counts = self.counts.setdefault(card.get('deck_id'), dict.fromkeys(('total',) + STAT_CLASSES, 0))
+        counts['total'] += delta
+        counts[interval_class(card)] += delta
+
+    def remove(self, card_id):
+        card = self.by_id.pop(card_id, None)
+        if card is not None:
+            deck_id = card.get('deck_id')
+            self.by_deck[deck_id].pop(card_id, None)
+            self._members[deck_id] = self._members.get(deck_id, 0) + 1
+            self.due[deck_id].discard(self._due_ts.pop(card_id), card_id)
+            self._count(card, -1)
+            if self._search is not None:
+                self._search.remove(card_id)
+            if self._dedup is not None:
+                self._dedup.remove(card_id)
+        return card
+
+    def cards(self, deck_id=None):
+        if deck_id is None:
+            return list(self.by_id.values())
+        return list(self.by_deck.get(deck_id, {}).values())
+
+    def deck_page(self, deck_id, limit, after_id):
+        """A deck's cards after `after_id`, in deck order, plus the cursor for the next page.
+
+        Finding the cursor is a dict lookup, so walking a large deck page by
+        page stays linear. Raises KeyError if `after_id` is not in the deck.
+        """
+        members = self._members.get(deck_id, 0)
+        order = self._order.get(deck_id)
+        if order is None or order[0] != members:
+            ids = list(self.by_deck.get(deck_id, {}))
+            order = self._order[deck_id] = (members, ids, {card_id: i for i, card_id in enumerate(ids)})
+        _, ids, positions = order
+        start = positions[after_id] + 1 if after_id else 0
+        end = start + limit if limit else len(ids)
+        deck = self.by_deck.get(deck_id, {})
+        # A write racing the rebuild can leave an id that has just left the deck
+        page = [deck[card_id] for card_id in ids[start:end] if card_id in deck]
+        next_after_id = ids[end - 1] if end < len(ids) else None
+        return page, next_after_id
+
+    def due_cards(self, deck_id, now_ts):
+        queue = self.due.get(deck_id)
+        if queue is None:
+            return []
+        return [self.by_id[card_id] for card_id in queue.due_ids(now_ts)]
+
+    def search(self, query, deck_id=None):
+        """Sorted ids of the cards matching `query`, optionally only in one deck."""
+        if self._search is None:
+            self._search = InvertedIndex(self.by_id.values())
+        within = self.by_deck.get(deck_id, {}).keys() if deck_id else None
+        return self._search.search(query, within)
+
+    @property
+    def duplicates(self):
+        if self._dedup is None:
+            self._dedup = DuplicateIndex(self.by_id.values())
+        return self._dedup
+
+    # Text indexes built on demand: name -> (attribute, class)
+    TEXT_INDEXES = {'search': ('_search', InvertedIndex), 'duplicates': ('_dedup', DuplicateIndex)}
+
+    def has_text_index(self, name):
+        return getattr(self, self.TEXT_INDEXES[name][0]) is not None
+
+    def attach_text_index(self, name, built):
+        """Use a search or duplicate index built from an earlier copy of the cards, after catching it up."""
+        attribute = self.TEXT_INDEXES[name][0]
+        if getattr(self, attribute) is not None:
+            return
+        # add() skips cards whose text is unchanged, so this only redoes what changed since
+        for card in self.by_id.values():
+            built.add(card)
+        for card_id in [card_id for card_id in built.ids() if card_id not in self.by_id]:
+            built.remove(card_id)
+        setattr(self, attribute, built)
+
+    def adopt_text_indexes(self, old):
+        """Carry the text indexes of the index this one replaces over, so a reload doesn't drop them."""
+        for name, (attribute, _) in self.TEXT_INDEXES.items():
+            built = getattr(old, attribute)
+            if built is not None:
+                self.attach_text_index(name, built)
+
+    def deck_stats(self, deck_id, now):
+        """Counts by interval class plus cards due by the end of today (overdue included)."""
+        stats = dict(self.counts.get(deck_id) or dict.fromkeys(('total',) + STAT_CLASSES, 0))
+        queue = self.due.get(deck_id)
+        stats['due_today'] = queue.count_before(day_starts(now, 1)[0]) if queue else 0
+        return stats
+
+    def forecast(self, deck_id, now, days=30):
+        """Cards falling due on each of the next `days` days; day 0 also holds overdue cards."""
+        queue = self.due.get(deck_id)
+        if queue is None:
+            return [0] * days
+        totals = [queue.count_before(ts) for ts in day_starts(now, days)]
+        return [total - previous for total, previous in zip(totals, [0] + totals[:-1])]
+
+
+class CachedCardStore:
+    """Keeps the whole collection in memory in front of a card store.
+
+    The index is reloaded only when the backing store's stamp (file
+    mtime/size) no longer matches what we last read or wrote, i.e. when
+    another process changed it. Stores with a change feed (SQLite) are
+    caught up with just the cards that changed instead. Local writes update
+    the index in place and bump `version`, which derived caches can key on.
+
+    All writes go through `mutate`, which runs them one at a time under an
+    in-process lock plus a cross-process file lock, against the latest data,
+    and group-commits writes that arrive together into a single flush.
+
+    Card dicts returned from listings are shared with the cache and must be
+    treated as read-only; `get_card` returns a copy that is safe to modify.
+    """
+
+    def __init__(self, store, write_window=0.002):
+        self.store = store
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.catchups = 0
+        # Time spent loading the collection from the backend and writing it back
+        self.load_seconds = 0.0
+        self.flush_seconds = 0.0
+        self._index = None
+        self._stamp = None
+        # Position in the store's change feed that the index reflects
+        self._seq = None
+        self._clusters = None
+        self._prepare_lock = threading.Lock()
+        self._lock = threading.RLock()
+        self._committer = GroupCommitter(self._flush, window=write_window)
+
+    def _current(self):
+        stamp = self.store.stamp()
+        with self._lock:
+            if self._index is not None and stamp == self._stamp:
+                self.hits += 1
+                return self._index
+            if self._index is not None and self._seq is not None:
+                changes = self.store.changes_since(self._seq)
+                if changes is not None:
+                    self.catchups += 1
+                    self._seq, changed, deleted = changes
+                    for card_id in deleted:
+                        self._index.remove(card_id)
+                    self._index.put_many(changed)
+                    self._stamp = stamp
+                    self.version += 1
+                    return self._index
+            self.misses += 1
+            started = time.perf_counter()
+            # Read before the cards: a change in between is applied again on the next catch-up, which is harmless
+            self._seq = self.store.last_change() if self.store.change_feed else None
+            old = self._index
+            self._index = CardIndex(self.store.all_cards())
+            if old is not None:
+                self._index.adopt_text_indexes(old)
+            self.load_seconds += time.perf_counter() - started
+            self._stamp = stamp
+            self.version += 1
+            return self._index
+
+    def warm(self):
+        """Load the index now rather than on the first request."""
+        self._current()
+
+    def prepare_text_index(self, name):
+        """Build the 'search' or 'duplicates' index without holding the write locks.
+
+        Building one for 100k cards takes seconds; done lazily under the lock
+        it would block every writer that long. The cards are copied under the
+        lock, indexed outside it, and writes made meanwhile are applied
+        before the index is attached. Reloads carry it over.
+        """
+        with self._prepare_lock:
+            index = self._current()
+            if index.has_text_index(name):
+                return
+            with self._lock:
+                cards = list(index.by_id.values())
+            built = CardIndex.TEXT_INDEXES[name][1](cards)
+            with self._lock:
+                index.attach_text_index(name, built)
+
+    def prepare_duplicates(self):
+        self.prepare_text_index('duplicates')
+
+    def mutate(self, fn):
+        """Apply fn(index) -> (result, changed_cards, deleted_ids) and persist it.
+
+        fn must validate before touching the index: if it raises, the error
+        is re-raised to the caller, but any changes it already made stay.
+        """
+        return self._committer.submit(fn)
+
+    def _flush(self, batch):
+        with self._lock, file_lock(self.store.lock_path):
+            index = self._current()
+            changed = {}
+            deleted = set()
+            for slot in batch:
+                try:
+                    slot['result'], slot_changed, slot_deleted = slot['fn'](index)
+                except Exception as e:
+                    slot['error'] = e
+                    continue
+                for card in slot_changed:
+                    changed[card['id']] = card
+                    deleted.discard(card['id'])
+                for card_id in slot_deleted:
+                    changed.pop(card_id, None)
+                    deleted.add(card_id)
+            if not changed and not deleted:
+                return
+            started = time.perf_counter()
+            try:
+                if self.store.row_level:
+                    self.store.apply_changes(list(changed.values()), list(deleted))
+                else:
+                    self.store.replace_cards(index.cards())
+            except Exception:
+                # Memory is ahead of disk now; reload on next access.
+                self._index = None
+                raise
+            finally:
+                self.flush_seconds += time.perf_counter() - started
+            self._stamp = self.store.stamp()
+            if self.store.change_feed:
+                # Under the file lock, so the feed holds nothing newer than our own write
+                self._seq = self.store.last_change()
+            self.version += 1
+
+    def all_cards(self):
+        return self._current().cards()
+
+    def cards_in_deck(self, deck_id):
+        return self._current().cards(deck_id)
+
+    def deck_page(self, deck_id, limit=None, after_id=None):
+        return self._current().deck_page(deck_id, limit, after_id)
+
+    def due_cards(self, deck_id, now=None):
+        """Cards in the deck whose due_date is at or before `now` (a datetime)."""
+        now_ts = now.timestamp() if now is not None else time.time()
+        return self._current().due_cards(deck_id, now_ts)
+
+    def search(self, query, deck_id=None):
+        self.prepare_text_index('search')
+        # Under the lock, so a concurrent write can't change the postings mid-query
+        with self._lock:
+            return self._current().search(query, deck_id)
+
+    def duplicate_clusters(self, deck_id=None, near=True, threshold=SIMILARITY):
+        """(sorted card ids, all exact duplicates?) per cluster, largest first.
+
+        The last result is kept until the collection changes, so paging
+        through the clusters doesn't recompute them.
+        """
+        self.prepare_duplicates()
+        with self._lock:
+            index = self._current()
+            key = (self.version, deck_id, near, threshold)
+            if self._clusters is None or self._clusters[0] != key:
+                within = index.by_deck.get(deck_id, {}).keys() if deck_id else None
+                groups = index.duplicates.clusters(index.by_id, within, near, threshold)
+                self._clusters = (key, [(group, index.duplicates.is_exact(group)) for group in groups])
+            return self._clusters[1]
+
+    def deck_stats(self, deck_id, now=None):
+        return self._current().deck_stats(deck_id, now or datetime.now())
+
+    def forecast(self, deck_id, now=None, days=30):
+        return self._current().forecast(deck_id, now or datetime.now(), days)
+
+    def get_card(self, card_id):
+        card = self._current().by_id.get(card_id)
+        return dict(card) if card is not None else None
+
+    def put_card(self, card):
+        self.put_cards([card])
+
+    def put_cards(self, cards):
+        def apply(index):
+            index.put_many(cards)
+            return None, cards, ()
+        self.mutate(apply)
+
+    def update_card(self, card_id, fn):
+        """Call fn on a copy of the card and store it; None if there is no such card."""
+        def apply(index):
+            card = index.by_id.get(card_id)
+            if card is None:
+                return None, (), ()
+            card = dict(card)
+            fn(card)
+            index.put(card)
+            return dict(card), [card], ()
+        return self.mutate(apply)
+
+    def delete_card(self, card_id):
+        def apply(index):
+            if index.remove(card_id) is None:
+                return False, (), ()
+            return True, (), [card_id]
+        return self.mutate(apply)
+
+    def replace_cards(self, cards):
+        with self._lock, file_lock(self.store.lock_path):
+            started = time.perf_counter()
+            self.store.replace_cards(cards)
+            self.flush_seconds += time.perf_counter() - started
+            self._index = CardIndex(cards)
+            self._stamp = self.store.stamp()
+            self._seq = self.store.last_change() if self.store.change_feed else None
+            self.version += 1
+
+    def get_decks(self):
+        return self.store.get_decks()
+
+    def save_decks(self, decks):
+        with file_lock(self.store.decks_lock_path):
+            self.store.save_decks(decks)
+
+    def add_deck(self, deck):
+        with file_lock(self.store.decks_lock_path):
+            decks = self.store.get_decks()
+            decks.append(deck)
+            self.store.save_decks(decks)
+        return deck
+
+    def remove_deck(self, deck_id):
+        """Drop the deck from the deck list; its cards must already be gone. False if unknown."""
+        with file_lock(self.store.decks_lock_path):
+            decks = self.store.get_decks()
+            remaining = [deck for deck in decks if deck['id'] != deck_id]
+            if len(remaining) == len(decks):
+                return False
+            self.store.save_decks(remaining)
+        return True
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'catchups': self.catchups,
+            'version': self.version,
+            'write_batches': self._committer.batches,
+            'writes': self._committer.commits,
+            'load_seconds': round(self.load_seconds, 6),
+            'flush_seconds': round(self.flush_seconds, 6),
+            'bytes_written': self.store.bytes_written,
+        }
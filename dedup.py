@@ -0,0 +1,317 @@
+import hashlib
+from collections import ChainMap
+from datetime import datetime
+
+from search import tokenize
+
+# Character shingle length; works the same for Persian, Latin or mixed text
+SHINGLE = 4
+# MinHash signature of BANDS * ROWS values, one LSH bucket per band. Cards
+# with Jaccard similarity s share at least one bucket with probability
+# 1 - (1 - s**ROWS)**BANDS: 0.98 at s=0.8, 0.56 at s=0.5
+BANDS = 8
+ROWS = 4
+SIGNATURE = BANDS * ROWS
+# Default Jaccard similarity of shingle sets at which two cards count as near-duplicates
+SIMILARITY = 0.8
+DUPLICATE_MODES = ('exact', 'near')
+# Review state carried over to the card that survives a merge
+REVIEW_FIELDS = ('interval', 'due_date', 'srs', 'last_reviewed_at', 'last_review_id')
+
+# Above every string hash, so the first shingle in a bin always replaces it
+_EMPTY = 1 << 64
+
+
+def folded(text):
+    """A card field as search sees it: casefolded, Persian/Arabic variants folded, punctuation dropped."""
+    return ' '.join(tokenize(text))
+
+
+def pair_text(question, answer):
+    """Folded question and answer in one string; equal for exact duplicates."""
+    return folded(question) + ' | ' + folded(answer)
+
+
+def card_text(card):
+    return pair_text(card.get('question'), card.get('answer'))
+
+
+def exact_key(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def _shingle_list(text):
+    if len(text) <= SHINGLE:
+        return [text]
+    return [text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)]
+
+
+def shingles(card):
+    return set(_shingle_list(card_text(card)))
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def signature(shingle_list):
+    """One-permutation MinHash: each shingle is hashed once and kept as the minimum of its bin.
+
+    Empty bins borrow from the next non-empty one, so short cards still get a
+    full signature. Uses the process's string hash, so signatures are only
+    comparable within one process.
+    """
+    bins = [_EMPTY] * SIGNATURE
+    for h in map(hash, shingle_list):
+        slot = h % SIGNATURE
+        if h < bins[slot]:
+            bins[slot] = h
+    if _EMPTY in bins:
+        filled = [i for i, value in enumerate(bins) if value != _EMPTY]
+        for i in range(SIGNATURE):
+            if bins[i] == _EMPTY:
+                source = next((j for j in filled if j > i), filled[0])
+                bins[i] = bins[source] + (source - i) % SIGNATURE
+    return bins
+
+
+def band_keys(text):
+    sig = signature(_shingle_list(text))
+    return tuple(hash(tuple(sig[b * ROWS:(b + 1) * ROWS])) for b in range(BANDS))
+
+
+def review_rank(card):
+    """Sort key for how far along a card's reviews are; the highest survives a merge."""
+    return (card.get('interval') or 0, card.get('last_reviewed_at') or '', card.get('due_date') or '')
+
+
+class DuplicateIndex:
+    """Exact-duplicate hash index plus MinHash/LSH buckets for near-duplicates.
+
+    Updated one card at a time like the search index. Finding a card's
+    near-duplicates only compares it against the cards sharing one of its
+    LSH buckets, so nothing is ever compared pairwise across the collection.
+    """
+
+    # Members of one LSH bucket are compared against at most this many
+    # representatives, so a bucket of templated cards stays linear
+    MAX_ANCHORS = 4
+
+    def __init__(self, cards=()):
+        self.exact = {}
+        self.buckets = [{} for _ in range(BANDS)]
+        self._entries = {}
+        for card in cards:
+            self.add(card)
+
+    def add(self, card):
+        card_id = card['id']
+        text = (card.get('question'), card.get('answer'))
+        old = self._entries.get(card_id)
+        if old is not None:
+            if old[0] == text:
+                return
+            self.remove(card_id)
+        folded_text = card_text(card)
+        key = exact_key(folded_text)
+        bands = band_keys(folded_text)
+        self._entries[card_id] = (text, key, bands)
+        self.exact.setdefault(key, set()).add(card_id)
+        for bucket, band in zip(self.buckets, bands):
+            bucket.setdefault(band, set()).add(card_id)
+
+    def ids(self):
+        return self._entries.keys()
+
+    def remove(self, card_id):
+        entry = self._entries.pop(card_id, None)
+        if entry is None:
+            return
+        _, key, bands = entry
+        self._discard(self.exact, key, card_id)
+        for bucket, band in zip(self.buckets, bands):
+            self._discard(bucket, band, card_id)
+
+    @staticmethod
+    def _discard(table, key, card_id):
+        ids = table[key]
+        ids.discard(card_id)
+        if not ids:
+            del table[key]
+
+    def find(self, card, mode='exact', threshold=SIMILARITY, cards=None):
+        """Id of a card already indexed that duplicates `card`, or None.
+
+        In 'near' mode, candidates come from the LSH buckets and are checked
+        against `threshold`; `cards` maps ids to the indexed card dicts.
+        """
+        folded_text = card_text(card)
+        ids = self.exact.get(exact_key(folded_text), ())
+        match = next((card_id for card_id in sorted(ids) if card_id != card.get('id')), None)
+        if match is not None or mode != 'near':
+            return match
+        own = set(_shingle_list(folded_text))
+        seen = set()
+        for bucket, band in zip(self.buckets, band_keys(folded_text)):
+            for card_id in sorted(bucket.get(band, ())):
+                if card_id in seen or card_id == card.get('id'):
+                    continue
+                seen.add(card_id)
+                if jaccard(own, shingles(cards[card_id])) >= threshold:
+                    return card_id
+        return None
+
+    def clusters(self, cards, within=None, near=True, threshold=SIMILARITY):
+        """Groups of duplicate card ids, largest first, each a sorted list.
+
+        `cards` maps ids to card dicts; `within` (a set or keys view)
+        restricts the search, e.g. to one deck.
+        """
+        parent = {}
+
+        def root(card_id):
+            while parent.get(card_id, card_id) != card_id:
+                parent[card_id] = parent.get(parent[card_id], parent[card_id])
+                card_id = parent[card_id]
+            return card_id
+
+        def union(a, b):
+            a, b = root(a), root(b)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+        def members(ids):
+            return sorted(ids if within is None else (card_id for card_id in ids if card_id in within))
+
+        for ids in self.exact.values():
+            if len(ids) > 1:
+                group = members(ids)
+                for card_id in group[1:]:
+                    union(group[0], card_id)
+
+        if near:
+            cache = {}
+
+            def shingles_of(card_id):
+                if card_id not in cache:
+                    cache[card_id] = shingles(cards[card_id])
+                return cache[card_id]
+
+            for bucket in self.buckets:
+                for ids in bucket.values():
+                    if len(ids) < 2:
+                        continue
+                    anchors = []
+                    for card_id in members(ids):
+                        for anchor in anchors:
+                            if root(anchor) == root(card_id) or jaccard(shingles_of(anchor), shingles_of(card_id)) >= threshold:
+                                union(anchor, card_id)
+                                break
+                        else:
+                            if len(anchors) < self.MAX_ANCHORS:
+                                anchors.append(card_id)
+
+        groups = {}
+        for card_id in list(parent):
+            top = root(card_id)
+            groups.setdefault(top, {top}).add(card_id)
+        return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=lambda group: (-len(group), group[0]))
+
+    def is_exact(self, group):
+        return len({self._entries[card_id][1] for card_id in group}) == 1
+
+
+def merge_cards(group, keep=None):
+    """Merge a group of duplicate cards into one.
+
+    The kept card (by default the one furthest along in its reviews) keeps
+    its text and deck, and takes the review state of the most advanced card
+    in the group. Returns (merged card, ids to delete).
+    """
+    advanced = max(group, key=review_rank)
+    kept = next((card for card in group if card['id'] == keep), advanced) if keep else advanced
+    merged = dict(kept)
+    for field in REVIEW_FIELDS:
+        if field in advanced:
+            merged[field] = advanced[field]
+        else:
+            merged.pop(field, None)
+    merged['merged_ids'] = sorted(set(kept.get('merged_ids', ())) | {card['id'] for card in group if card is not kept})
+    merged['merged_at'] = datetime.now().isoformat()
+    return merged, [card['id'] for card in group if card is not kept]
+
+
+def insert_cards(cards, skip=None, threshold=SIMILARITY):
+    """An index function for CachedCardStore.mutate that adds new cards.
+
+    With skip='exact' or 'near', a card that duplicates one already stored
+    (or an earlier one in the same call) is left out. The result is
+    (added cards, [{"index", "duplicate_of"}] for the ones left out).
+    Call CachedCardStore.prepare_duplicates first, or the duplicate index
+    is built here, with the write locks held.
+    """
+    def apply(index):
+        if not skip:
+            index.put_many(cards)
+            return (list(cards), []), cards, ()
+        added = {}
+        duplicates = []
+        known = ChainMap(added, index.by_id)
+        for i, card in enumerate(cards):
+            match = index.duplicates.find(card, skip, threshold, known)
+            if match is not None:
+                duplicates.append({'index': i, 'duplicate_of': match})
+                continue
+            added[card['id']] = card
+            index.duplicates.add(card)
+        index.put_many(added.values())
+        return (list(added.values()), duplicates), list(added.values()), ()
+    return apply
+
+
+def merge_clusters(clusters):
+    """An index function for CachedCardStore.mutate that merges groups of duplicates, all or nothing.
+
+    Each cluster is a list of card ids or {"ids": [...], "keep": id}. The
+    result is (ok, per-cluster results); see merge_cards for what survives.
+    """
+    def apply(index):
+        results = []
+        plans = []
+        claimed = set()
+        for i, cluster in enumerate(clusters):
+            ids = cluster.get('ids') if isinstance(cluster, dict) else cluster
+            keep = cluster.get('keep') if isinstance(cluster, dict) else None
+            if not isinstance(ids, list) or len(set(map(str, ids))) < 2:
+                results.append({'index': i, 'status': 'error', 'error': 'A cluster needs at least two card ids'})
+                continue
+            ids = list(dict.fromkeys(map(str, ids)))
+            missing = [card_id for card_id in ids if card_id not in index.by_id]
+            if missing:
+                results.append({'index': i, 'status': 'error', 'error': f"Card not found: {', '.join(missing)}"})
+                continue
+            if claimed & set(ids):
+                results.append({'index': i, 'status': 'error', 'error': 'A card appears in more than one cluster'})
+                continue
+            if keep is not None and keep not in ids:
+                results.append({'index': i, 'status': 'error', 'error': "'keep' must be one of the cluster's ids"})
+                continue
+            claimed.update(ids)
+            merged, deleted = merge_cards([index.by_id[card_id] for card_id in ids], keep)
+            plans.append((merged, deleted))
+            results.append({'index': i, 'status': 'ok', 'kept': merged['id'], 'deleted': deleted})
+        if any(result['status'] == 'error' for result in results):
+            for result in results:
+                if result['status'] == 'ok':
+                    result['status'] = 'skipped'
+            return (False, results), (), ()
+        changed = []
+        deleted = []
+        for merged, removed in plans:
+            for card_id in removed:
+                index.remove(card_id)
+            index.put(merged)
+            changed.append(merged)
+            deleted += removed
+        return (True, results), changed, deleted
+    return apply
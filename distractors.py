@@ -0,0 +1,109 @@
+import heapq
+import random
+import threading
+from array import array
+
+# Trigrams shared by more answers than this are too common to say anything
+# about similarity, and walking their posting lists would cost O(deck).
+MAX_POSTING = 500
+
+
+def char_ngrams(text, n=3):
+    text = f' {text.lower().strip()} '
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class DeckAnswers:
+    """The distinct answers of one deck, precomputed for distractor sampling."""
+
+    def __init__(self, cards):
+        self.answers = []
+        self.position = {}
+        for card in cards:
+            answer = card.get('answer')
+            if answer and answer not in self.position:
+                self.position[answer] = len(self.answers)
+                self.answers.append(answer)
+        self._grams = None
+        self._postings = None
+        self._lock = threading.Lock()
+
+    def sample(self, correct, k, rng=random):
+        """k random answers other than `correct`, drawn by index in O(k)."""
+        n = len(self.answers)
+        skip = self.position.get(correct)
+        pool = n - 1 if skip is not None else n
+        picks = rng.sample(range(pool), min(k, pool))
+        if skip is not None:
+            # Shift indexes at or past the correct answer to skip over it
+            picks = [i + 1 if i >= skip else i for i in picks]
+        return [self.answers[i] for i in picks]
+
+    def _build_similarity_index(self):
+        with self._lock:
+            if self._postings is not None:
+                return
+            grams = []
+            postings = {}
+            for i, answer in enumerate(self.answers):
+                answer_grams = char_ngrams(answer)
+                grams.append(answer_grams)
+                for gram in answer_grams:
+                    postings.setdefault(gram, array('I')).append(i)
+            self._grams = grams
+            self._postings = postings
+
+    def similar(self, correct, k, rng=random):
+        """k answers that look most like `correct` (shared character trigrams, then length).
+
+        Falls back to random answers when too few share any trigram with it.
+        """
+        self._build_similarity_index()
+        skip = self.position.get(correct)
+        correct_grams = self._grams[skip] if skip is not None else char_ngrams(correct)
+        shared = {}
+        for gram in correct_grams:
+            posting = self._postings.get(gram)
+            if posting is None or len(posting) > MAX_POSTING:
+                continue
+            for i in posting:
+                if i != skip:
+                    shared[i] = shared.get(i, 0) + 1
+
+        def score(i):
+            overlap = shared[i]
+            jaccard = overlap / (len(correct_grams) + len(self._grams[i]) - overlap)
+            return (jaccard, -abs(len(self.answers[i]) - len(correct)))
+
+        picks = heapq.nlargest(k, shared, key=score)
+        result = [self.answers[i] for i in picks]
+        if len(result) < k:
+            taken = set(result)
+            taken.add(correct)
+            for answer in self.sample(correct, k + len(taken), rng):
+                if answer not in taken:
+                    result.append(answer)
+                    taken.add(answer)
+                    if len(result) == k:
+                        break
+        return result
+
+
+class DistractorEngine:
+    """Per-deck DeckAnswers, rebuilt only when the card store version changes."""
+
+    def __init__(self):
+        self._decks = {}
+        self._lock = threading.Lock()
+
+    def for_deck(self, deck_id, version, load_cards):
+        with self._lock:
+            entry = self._decks.get(deck_id)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        deck_answers = DeckAnswers(load_cards())
+        with self._lock:
+            self._decks[deck_id] = (version, deck_answers)
+        return deck_answers
@@ -0,0 +1,315 @@
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+from pdf_ingest import CHARS_PER_TOKEN
+
+# Several small prompts sent as one call start with this line; FakeModel looks for it too
+BATCH_HEADER = 'Answer each of the following numbered requests independently.'
+# Error class names (google.api_core and builtins) that are worth retrying
+RETRYABLE = {'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+             'DeadlineExceeded', 'Aborted', 'TimeoutError', 'ConnectionError', 'TransientError'}
+
+
+class TransientError(Exception):
+    """A failure the client retries, e.g. rate limiting; raised by FakeModel on request."""
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Offline stand-in for a Gemini model.
+
+    Answers every prompt with canned JSON in the shape the prompt asks for
+    (flashcards or a quiz), wrapped in a ```json fence like the real model
+    tends to do. Select it with "gemini_backend": "fake" in config.json.
+    The first `failures` calls raise TransientError, to exercise retries.
+    """
+
+    def __init__(self, model_name='fake', failures=0, latency=0):
+        self.model_name = model_name
+        self.calls = 0
+        self.failures = failures
+        self.latency = latency
+        self.prompts = []
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        self.prompts.append(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.calls <= self.failures:
+            raise TransientError('429 Resource exhausted (fake)')
+        if prompt.startswith(BATCH_HEADER):
+            parts = re.split(r'^### Request \d+\n', prompt, flags=re.M)[1:]
+            items = [self._answer(part) for part in parts]
+        else:
+            items = self._answer(prompt)
+        return FakeResponse('```json\n' + json.dumps(items, ensure_ascii=False, indent=2) + '\n```')
+
+    @staticmethod
+    def _answer(prompt):
+        match = re.search(r'(\d+)', prompt)
+        count = min(int(match.group(1)), 20) if match else 5
+        # The text after the last instruction colon, or the start of the prompt
+        subject = (prompt.split(':', 1)[-1].strip().splitlines() or [''])[0][:40] if ':' in prompt else prompt[:40]
+        if 'multiple choice' in prompt:
+            return [{
+                'question': f'Question {i + 1} about {subject}?',
+                'options': [f'Option {j + 1}' for j in range(4)],
+                'answer': 'Option 1',
+            } for i in range(count)]
+        return [{'question': f'Question {i + 1} about {subject}', 'answer': f'Answer {i + 1}'} for i in range(count)]
+
+
+def _google_model(config):
+    # Imported on first use: it is slow to import and most requests never need it
+    import google.generativeai as genai
+    genai.configure(api_key=config['gemini_api_key'])
+    return genai.GenerativeModel(config['gemini_model'])
+
+
+def _fake_model(config):
+    return FakeModel(config.get('gemini_model', 'fake'), config.get('gemini_fake_failures', 0),
+                     config.get('gemini_fake_latency', 0))
+
+
+# "gemini_backend" name -> factory taking the config; register_backend adds more
+BACKENDS = {'google': _google_model, 'fake': _fake_model}
+
+
+def register_backend(name, factory):
+    BACKENDS[name] = factory
+
+
+def needs_api_key(config):
+    return config.get('gemini_backend', 'google') == 'google'
+
+
+def get_model(config):
+    """The configured model: the real Gemini client, or FakeModel for offline use."""
+    backend = config.get('gemini_backend', 'google')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown gemini_backend: {backend}")
+    return BACKENDS[backend](config)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def strip_fence(text):
+    match = re.search(r'```(?:json)?\s*(.*?)```', text, re.S)
+    return match.group(1) if match else text
+
+
+def _trim(text, max_chars):
+    text = str(text or '')
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + '…'
+
+
+def cards_for_prompt(cards, max_tokens=8000, max_field_chars=400, seed=0):
+    """Cards reduced to question/answer and trimmed to fit `max_tokens` of JSON.
+
+    Each field is cut at `max_field_chars`. If the deck still doesn't fit, a
+    random sample (fixed by `seed`, so the same deck gives the same prompt)
+    is taken, kept in deck order. Returns (JSON string, cards used).
+    """
+    items = [{'question': _trim(card.get('question'), max_field_chars), 'answer': _trim(card.get('answer'), max_field_chars)}
+             for card in cards if card.get('question')]
+    sizes = [len(json.dumps(item, ensure_ascii=False)) + 2 for item in items]
+    budget = max_tokens * CHARS_PER_TOKEN
+    if sum(sizes) > budget:
+        order = list(range(len(items)))
+        random.Random(seed).shuffle(order)
+        chosen = []
+        used = 0
+        for i in order:
+            if used + sizes[i] <= budget:
+                chosen.append(i)
+                used += sizes[i]
+        items = [items[i] for i in sorted(chosen)]
+    return json.dumps(items, ensure_ascii=False), len(items)
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, in bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take `tokens` now and return how long to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def is_retryable(error):
+    return any(cls.__name__ in RETRYABLE for cls in type(error).__mro__)
+
+
+class GeminiClient:
+    """One model per configuration, shared by every AI job in the process.
+
+    Calls go through a token bucket (`gemini_requests_per_minute`), time out
+    after `gemini_timeout` seconds and are retried with exponential backoff
+    and jitter on rate-limit, timeout and server errors (`gemini_max_retries`).
+    generate(batch=True) lets small prompts that arrive within
+    `gemini_batch_window` seconds of each other share one call.
+    """
+
+    def __init__(self, config, model=None):
+        self.backend = config.get('gemini_backend', 'google')
+        self.model = model if model is not None else get_model(config)
+        per_minute = config.get('gemini_requests_per_minute', 60)
+        self.bucket = TokenBucket(per_minute / 60.0, config.get('gemini_burst', max(1, per_minute // 6)))
+        self.timeout = config.get('gemini_timeout', 60)
+        self.max_retries = config.get('gemini_max_retries', 3)
+        self.backoff = config.get('gemini_backoff', 1.0)
+        self.max_backoff = config.get('gemini_max_backoff', 30.0)
+        self.batch_window = config.get('gemini_batch_window', 0.05)
+        self.batch_size = config.get('gemini_batch_size', 4)
+        self.batch_tokens = config.get('gemini_batch_tokens', 2000)
+        self.calls = 0
+        self.retries = 0
+        self.batched = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+        # The batch still taking prompts: (prompts with their futures, set when full)
+        self._open = None
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'retries': self.retries, 'batched_prompts': self.batched,
+                    'throttled_seconds': round(self.throttled_seconds, 3)}
+
+    def generate(self, prompt, batch=False, check_cancelled=None):
+        """Response text for `prompt`.
+
+        `check_cancelled` is called before every attempt and may raise to
+        stop waiting, e.g. Job.check_cancelled.
+        """
+        if batch and self.batch_size > 1 and estimate_tokens(prompt) <= self.batch_tokens:
+            return self._submit(prompt, check_cancelled)
+        return self._call(prompt, check_cancelled)
+
+    def _call(self, prompt, check_cancelled=None):
+        attempt = 0
+        while True:
+            if check_cancelled:
+                check_cancelled()
+            waited = self.bucket.acquire()
+            with self._lock:
+                self.calls += 1
+                self.throttled_seconds += waited
+            try:
+                return self.model.generate_content(prompt, request_options={'timeout': self.timeout}).text
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            time.sleep(random.uniform(delay / 2, delay))
+
+    def _submit(self, prompt, check_cancelled):
+        # The prompt that opens a batch waits out the window (or until the batch
+        # is full) and sends just that batch; a prompt arriving after it closed
+        # opens the next one, so no caller ever sends more than one batch
+        future = Future()
+        with self._lock:
+            leader = self._open is None
+            if leader:
+                self._open = ([], threading.Event())
+            pending, full = self._open
+            pending.append((prompt, future))
+            if len(pending) >= self.batch_size:
+                self._open = None
+                full.set()
+        if leader:
+            full.wait(self.batch_window)
+            with self._lock:
+                if self._open is not None and self._open[0] is pending:
+                    self._open = None
+            self._run_batch(pending, check_cancelled)
+        return future.result()
+
+    def _run_batch(self, pending, check_cancelled):
+        prompts = [prompt for prompt, _ in pending]
+        # `check_cancelled` belongs to the job that opened the batch; it only
+        # applies when that job's prompt is alone, so it can't fail other jobs' prompts
+        if len(prompts) > 1:
+            check_cancelled = None
+        try:
+            if len(prompts) == 1:
+                answers = [self._call(prompts[0], check_cancelled)]
+            else:
+                answers = self._call_batch(prompts, check_cancelled)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), answer in zip(pending, answers):
+            future.set_result(answer)
+
+    def _call_batch(self, prompts, check_cancelled):
+        combined = '\n\n'.join([BATCH_HEADER + f' Reply with a single JSON array of {len(prompts)} elements, '
+                                'element i being the JSON answer to request i.']
+                               + [f'### Request {i + 1}\n{prompt}' for i, prompt in enumerate(prompts)])
+        text = self._call(combined, check_cancelled)
+        try:
+            answers = json.loads(strip_fence(text))
+        except (json.JSONDecodeError, TypeError):
+            answers = None
+        if not isinstance(answers, list) or len(answers) != len(prompts):
+            # The model didn't keep the requests apart; ask for each one on its own
+            return [self._call(prompt, check_cancelled) for prompt in prompts]
+        with self._lock:
+            self.batched += len(prompts)
+        return [json.dumps(answer, ensure_ascii=False) for answer in answers]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(config):
+    """The shared GeminiClient for this configuration; built (and the API configured) once."""
+    key = json.dumps({name: value for name, value in config.items() if name.startswith('gemini_')}, sort_keys=True)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = GeminiClient(config)
+        return client
+
+
+def client_stats():
+    """Totals of GeminiClient.stats() over every client built in this process."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    totals = {'calls': 0, 'retries': 0, 'batched_prompts': 0, 'throttled_seconds': 0.0}
+    for client in clients:
+        for name, value in client.stats().items():
+            totals[name] += value
+    return totals
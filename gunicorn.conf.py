@@ -0,0 +1,59 @@
+# gunicorn -c gunicorn.conf.py
+#
+# The app is created once in the master (preload), which loads config.json,
+# opens the card store and reads the collection into memory; workers are
+# forked from it and start out sharing that memory. Each worker then keeps
+# its own copy up to date: cross-process writes go through file locks, and
+# with "card_store": "sqlite" a worker picks up other workers' writes from
+# the change feed instead of re-reading the collection. With the JSON store
+# every write makes the other workers re-read the whole file, so a single
+# worker is started unless config.json selects SQLite. With several workers,
+# also set "job_state_dir" so any of them can answer for an AI job.
+import gc
+import json
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app(preload=True)'
+preload_app = True
+
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '5000'))
+
+
+def _card_store():
+    try:
+        with open('config.json', encoding='utf-8') as f:
+            return json.load(f).get('card_store', 'json')
+    except (OSError, ValueError):
+        return 'json'
+
+
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 8) if _card_store() == 'sqlite' else 1))
+# Threads let a worker keep serving while one of its requests waits on a file lock or a streamed response
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# AI jobs stream progress over server-sent events for up to a couple of minutes
+timeout = 150
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+# Without this only warnings reach the log: the app's loggers (e.g. the JSON
+# events written by metrics.log_event) would have no handler at INFO
+logconfig_dict = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {'generic': {'format': '%(asctime)s [%(process)d] [%(levelname)s] %(name)s: %(message)s',
+                               'datefmt': '[%Y-%m-%d %H:%M:%S %z]'}},
+    'handlers': {'console': {'class': 'logging.StreamHandler', 'formatter': 'generic', 'stream': 'ext://sys.stdout'}},
+    'root': {'level': os.environ.get('LOG_LEVEL', 'INFO'), 'handlers': ['console']},
+    # gunicorn's own loggers go through the root handler too, so each line is written once
+    'loggers': {'gunicorn.error': {'level': 'INFO', 'handlers': [], 'propagate': True},
+                'gunicorn.access': {'level': 'INFO', 'handlers': [], 'propagate': True}},
+}
+
+
+def when_ready(server):
+    # Keep the garbage collector from touching (and so copying) the preloaded objects in every worker
+    gc.freeze()
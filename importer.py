@@ -0,0 +1,214 @@
+import codecs
+import csv
+import json
+import time
+from datetime import datetime
+
+from dedup import exact_key, pair_text
+from store import new_id
+
+CHUNK_SIZE = 64 * 1024
+IMPORT_FORMATS = ('.json', '.ndjson', '.jsonl', '.csv', '.tsv')
+# Characters that can still extend a JSON number that ends at them
+NUMBER_CHARS = '.eE+-'
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def content_key(question, answer):
+    """Hash of a normalized question/answer pair; the same exact-duplicate test as dedup.py."""
+    return exact_key(pair_text(question, answer))
+
+
+def _decode_chunks(stream):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+
+def iter_json_array(stream):
+    """Yield the items of a top-level JSON array without parsing the whole upload at once."""
+    decoder = json.JSONDecoder()
+    chunks = _decode_chunks(stream)
+    buf = ''
+    pos = 0
+    # What may come next: '[' to open the array, 'item' (or ']' right after
+    # the opening bracket), or ',' / ']' after an item
+    expect = '['
+    empty = True
+    exhausted = False
+
+    def fill():
+        nonlocal buf, pos, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos >= len(buf):
+            if exhausted or not fill():
+                raise ImportFormatError('Unexpected end of JSON file')
+            continue
+        char = buf[pos]
+        if expect == '[':
+            if char != '[':
+                raise ImportFormatError('Expected a JSON array of cards')
+            expect = 'item'
+            pos += 1
+            continue
+        if expect == ',':
+            if char == ']':
+                return
+            if char != ',':
+                raise ImportFormatError('Malformed JSON array: expected "," or "]" after an item')
+            expect = 'item'
+            pos += 1
+            continue
+        if char == ']' and empty:
+            return
+        if char in ',]':
+            raise ImportFormatError('Malformed JSON array: expected an item')
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Probably an item cut off at the chunk boundary; read more and retry
+            if exhausted or not fill():
+                raise ImportFormatError('Malformed JSON array')
+            continue
+        if not exhausted and isinstance(item, (int, float)) and (end == len(buf) or buf[end] in NUMBER_CHARS):
+            # A number cut off at the chunk boundary (e.g. "12" of "12.5e3") may continue in the next chunk
+            if fill():
+                continue
+        yield item
+        pos = end
+        expect = ','
+        empty = False
+
+
+def iter_ndjson(stream):
+    for line in _iter_lines(stream):
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+
+def _iter_lines(stream):
+    # Lines keep their endings, so csv can restore newlines inside quoted fields
+    pending = ''
+    for chunk in _decode_chunks(stream):
+        pending += chunk
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+
+def iter_delimited(stream, delimiter):
+    """Rows of a CSV/TSV file as dicts; a header row naming question/answer is optional."""
+    reader = csv.reader(_iter_lines(stream), delimiter=delimiter)
+    header = None
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if header is None:
+            cells = [cell.strip().lower() for cell in row]
+            if 'question' in cells and 'answer' in cells:
+                header = cells
+                continue
+            header = ['question', 'answer']
+        yield dict(zip(header, row))
+
+
+def iter_records(stream, filename):
+    name = filename.lower()
+    if name.endswith('.json'):
+        return iter_json_array(stream)
+    if name.endswith(('.ndjson', '.jsonl')):
+        return iter_ndjson(stream)
+    if name.endswith('.csv'):
+        return iter_delimited(stream, ',')
+    if name.endswith('.tsv'):
+        return iter_delimited(stream, '\t')
+    raise ImportFormatError('Invalid file format')
+
+
+def _commit(commit, batch, report):
+    added = commit(batch)
+    if added is None:
+        added = len(batch)
+    report['imported'] += added
+    report['duplicates'] += len(batch) - added
+
+
+def import_stream(stream, filename, deck_id, existing_cards, commit, batch_size=1000):
+    """Parse an upload incrementally and commit new cards `batch_size` at a time.
+
+    With batch_size=None everything is committed at the end in one write,
+    which is what a store that rewrites the whole file on every commit wants.
+
+    Records without a question and answer are skipped. Records whose
+    normalized question/answer pair already exists in the deck (or earlier in
+    the same upload) are counted as duplicates and not imported. `commit` may
+    return how many of a batch it actually stored; the rest count as
+    duplicates too.
+
+    If the upload turns out to be malformed partway through, parsing stops
+    and the report carries an 'error'. The batches committed before it stay
+    imported and are counted in 'imported'; nothing after the last commit is.
+    """
+    started = time.perf_counter()
+    seen = {content_key(card.get('question'), card.get('answer')) for card in existing_cards}
+    report = {'imported': 0, 'skipped': 0, 'duplicates': 0}
+    records = iter_records(stream, filename)
+    batch = []
+    try:
+        for record in records:
+            if not isinstance(record, dict) or not record.get('question') or not record.get('answer'):
+                report['skipped'] += 1
+                continue
+            key = content_key(record['question'], record['answer'])
+            if key in seen:
+                report['duplicates'] += 1
+                continue
+            seen.add(key)
+            card = dict(record)
+            card['id'] = new_id()
+            card['due_date'] = datetime.now().isoformat()
+            card['interval'] = 0
+            if deck_id:
+                card['deck_id'] = deck_id
+            batch.append(card)
+            if batch_size and len(batch) >= batch_size:
+                _commit(commit, batch, report)
+                batch = []
+    except (ImportFormatError, UnicodeDecodeError) as e:
+        # Batches already committed stay; the cards parsed since are dropped
+        report['error'] = str(e)
+        batch = []
+    if batch:
+        _commit(commit, batch, report)
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['cards_per_second'] = round(report['imported'] / elapsed, 1) if elapsed > 0 else None
+    return report
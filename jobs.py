@@ -0,0 +1,312 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from store import new_id, read_json, write_json
+
+FINAL_STATES = ('succeeded', 'failed', 'cancelled', 'timed_out')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobError(Exception):
+    """A job failure with a user-facing message (the job's log is kept alongside)."""
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = new_id()
+        self.kind = kind
+        self.status = 'queued'
+        self.log = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._cancel = threading.Event()
+        self._queue = None
+        # Shared state file bookkeeping (JobQueue with a state_dir)
+        self._published_at = 0.0
+        self._publish_timer = None
+        self._written_version = -1
+
+    def progress(self, message):
+        """Add a line to the job's log; also the point where cancellation takes effect."""
+        self.log.append(message)
+        self._queue._changed(self)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if not self._cancel.is_set() and self._queue is not None and self._queue._cancel_requested(self.id):
+            self._cancel.set()
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    @property
+    def done(self):
+        return self.status in FINAL_STATES
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'log': '\n'.join(self.log),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.status == 'succeeded':
+            data['result'] = self.result
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class SharedJob:
+    """A job owned by another worker process, as last written to the shared state directory."""
+
+    def __init__(self, path, data):
+        self.path = path
+        self._data = data
+
+    @classmethod
+    def load(cls, path):
+        try:
+            data = read_json(path, None)
+        except (OSError, ValueError):
+            return None
+        return cls(path, data) if data is not None else None
+
+    @property
+    def id(self):
+        return self._data['job_id']
+
+    @property
+    def version(self):
+        return self._data.get('version')
+
+    @property
+    def done(self):
+        return self._data['status'] in FINAL_STATES
+
+    def refresh(self):
+        latest = SharedJob.load(self.path)
+        if latest is not None:
+            self._data = latest._data
+
+    def to_dict(self):
+        data = dict(self._data)
+        data.pop('version', None)
+        return data
+
+
+class JobQueue:
+    """In-process background jobs on a bounded thread pool.
+
+    At most `max_workers` jobs run at once and at most `max_pending` wait;
+    beyond that `submit` raises QueueFull. A job still running after
+    `timeout` seconds is marked timed_out and its result is dropped (the
+    thread itself can't be killed, so it finishes in the background).
+    Finished jobs are forgotten after `keep_finished` seconds.
+
+    With a `state_dir` shared by several worker processes, every job's state
+    is also written there, so any worker can report on or cancel it. Status
+    changes are written right away; progress lines at most every
+    PUBLISH_INTERVAL seconds, outside the queue's lock.
+    """
+
+    # How often a worker re-reads the state of a job owned by another worker
+    SHARED_POLL_INTERVAL = 0.25
+    # Progress lines are written to the state directory at most this often per job
+    PUBLISH_INTERVAL = 0.5
+
+    def __init__(self, max_workers=2, max_pending=20, timeout=120, keep_finished=3600, state_dir=None):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._futures = {}
+        self._cond = threading.Condition()
+        self._state_lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Queue fn(job, *args, **kwargs); its return value becomes the job result."""
+        job = Job(kind)
+        job._queue = self
+        with self._cond:
+            self._forget_old()
+            pending = sum(1 for j in self._jobs.values() if j.status == 'queued')
+            if pending >= self.max_pending:
+                raise QueueFull()
+            self._jobs[job.id] = job
+            self._publish(job)
+            self._futures[job.id] = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is None and self._state_path(job_id):
+            job = SharedJob.load(self._state_path(job_id))
+        return job
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self.get(job_id)
+                if job is not None and not job.done:
+                    # The owning worker notices at the job's next progress line
+                    open(self._state_path(job_id, '.cancel'), 'w').close()
+                return job
+            if job.done:
+                return job
+            job._cancel.set()
+            future = self._futures.get(job_id)
+            if future is not None and future.cancel():
+                # Never started
+                self._finish(job, 'cancelled', error='Job cancelled')
+        return job
+
+    def wait(self, job, seen_version, timeout):
+        """Block until the job changes past `seen_version` or `timeout` passes."""
+        if isinstance(job, SharedJob):
+            deadline = time.monotonic() + timeout
+            while job.version == seen_version and time.monotonic() < deadline:
+                time.sleep(self.SHARED_POLL_INTERVAL)
+                job.refresh()
+            return job.version
+        with self._cond:
+            self._cond.wait_for(lambda: job.version != seen_version, timeout=timeout)
+            return job.version
+
+    def _state_path(self, job_id, suffix='.json'):
+        # Job ids are ULIDs; anything else can't be a file of ours
+        if not self.state_dir or not str(job_id).isalnum():
+            return None
+        return os.path.join(self.state_dir, job_id + suffix)
+
+    def _publish(self, job):
+        # Caller holds self._cond
+        state = self._snapshot(job)
+        if state is not None:
+            self._write_state(job, state)
+
+    def _snapshot(self, job):
+        # Caller holds self._cond
+        if not self.state_dir:
+            return None
+        if job._publish_timer is not None:
+            job._publish_timer.cancel()
+            job._publish_timer = None
+        job._published_at = time.monotonic()
+        return dict(job.to_dict(), version=job.version)
+
+    def _write_state(self, job, state):
+        with self._state_lock:
+            # Progress is written outside self._cond, so an older snapshot may come in late
+            if state['version'] > job._written_version:
+                write_json(self._state_path(job.id), state)
+                job._written_version = state['version']
+
+    def _publish_pending(self, job):
+        with self._cond:
+            if job._publish_timer is None:
+                return
+            state = self._snapshot(job)
+        self._write_state(job, state)
+
+    def _cancel_requested(self, job_id):
+        path = self._state_path(job_id, '.cancel')
+        return path is not None and os.path.exists(path)
+
+    def _changed(self, job):
+        state = None
+        with self._cond:
+            job.version += 1
+            self._cond.notify_all()
+            if self.state_dir:
+                wait = job._published_at + self.PUBLISH_INTERVAL - time.monotonic()
+                if wait <= 0:
+                    state = self._snapshot(job)
+                elif job._publish_timer is None:
+                    # Written once the interval is up, unless a status change writes it first
+                    job._publish_timer = threading.Timer(wait, self._publish_pending, (job,))
+                    job._publish_timer.daemon = True
+                    job._publish_timer.start()
+        if state is not None:
+            self._write_state(job, state)
+
+    def _finish(self, job, status, result=None, error=None):
+        # Caller holds self._cond
+        if job.done:
+            return
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.version += 1
+        self._futures.pop(job.id, None)
+        self._publish(job)
+        self._cond.notify_all()
+
+    def _run(self, job, fn, args, kwargs):
+        with self._cond:
+            if job.done:
+                return
+            job.status = 'running'
+            job.started_at = time.time()
+            job.version += 1
+            self._publish(job)
+            self._cond.notify_all()
+        timer = threading.Timer(self.timeout, self._expire, (job,))
+        timer.daemon = True
+        timer.start()
+        try:
+            job.check_cancelled()
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            outcome = ('cancelled', None, 'Job cancelled')
+        except JobError as e:
+            outcome = ('failed', None, str(e))
+        except Exception as e:
+            outcome = ('failed', None, f'{type(e).__name__}: {e}')
+        else:
+            outcome = ('succeeded', result, None)
+        finally:
+            timer.cancel()
+        with self._cond:
+            self._finish(job, *outcome)
+
+    def _expire(self, job):
+        job._cancel.set()
+        with self._cond:
+            self._finish(job, 'timed_out', error=f'Job timed out after {self.timeout} seconds')
+
+    def _forget_old(self):
+        cutoff = time.time() - self.keep_finished
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+        if self.state_dir:
+            # Including files left behind by workers that have since exited
+            for name in os.listdir(self.state_dir):
+                path = os.path.join(self.state_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                except OSError:
+                    continue
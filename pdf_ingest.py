@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dedup import folded
+
+# Rough size of a token for budgeting prompts; Gemini averages ~4 characters.
+CHARS_PER_TOKEN = 4
+# Documents shorter than this are extracted in-process; a pool isn't worth starting.
+MIN_PAGES_FOR_POOL = 16
+
+
+def _extract_range(path, start, end):
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+
+def _page_count(path):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(pdf_bytes, workers=None, pages_per_task=16):
+    """Yield the text of each page, in order, extracting page ranges in parallel processes."""
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        count = _page_count(path)
+        workers = workers or min(4, os.cpu_count() or 1)
+        if count < MIN_PAGES_FOR_POOL or workers < 2:
+            yield from _extract_range(path, 0, count)
+            return
+        ranges = [(start, min(start + pages_per_task, count)) for start in range(0, count, pages_per_task)]
+        # Not fork: a forked child would inherit the request threads' locks mid-use and the worker's whole heap
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as pool:
+            # map() hands results back in order, while later ranges are still being extracted
+            for pages in pool.map(_extract_range, [path] * len(ranges), *zip(*ranges)):
+                yield from pages
+    finally:
+        os.unlink(path)
+
+
+def _split_long(text, max_chars):
+    """Split text that alone exceeds the budget on paragraph, then line, then hard boundaries."""
+    pieces = []
+    for part in re.split(r'(\n\s*\n)', text):
+        while len(part) > max_chars:
+            cut = part.rfind('\n', 0, max_chars)
+            if cut <= 0:
+                cut = part.rfind(' ', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(part[:cut])
+            part = part[cut:]
+        pieces.append(part)
+    return pieces
+
+
+def chunk_pages(pages, max_tokens):
+    """Group page texts into chunks of at most `max_tokens` (estimated) each."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    parts = []
+    size = 0
+    for page in pages:
+        for piece in ([page] if len(page) <= max_chars else _split_long(page, max_chars)):
+            if size + len(piece) > max_chars and parts:
+                yield ''.join(parts)
+                parts = []
+                size = 0
+            parts.append(piece)
+            size += len(piece)
+        parts.append('\n')
+        size += 1
+    text = ''.join(parts)
+    if text.strip():
+        yield text
+
+
+def dedupe_questions(questions):
+    """Drop questions that repeat an earlier one (compared as dedup.py folds them)."""
+    seen = set()
+    unique = []
+    for question in questions:
+        if not isinstance(question, dict) or not question.get('question'):
+            continue
+        key = folded(question['question'])
+        if key not in seen:
+            seen.add(key)
+            unique.append(question)
+    return unique
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def timed(self, stage, iterable):
+        """Wrap an iterator, charging the time spent producing each item to `stage`."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - started)
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+    def rounded(self):
+        return {stage: round(seconds, 3) for stage, seconds in self.seconds.items()}
+
+
+def generate_from_chunks(chunks, generate_chunk, concurrency=2, progress=None):
+    """Run generate_chunk(text, index) over the chunks with at most `concurrency` in flight.
+
+    Chunks are pulled from the iterator only when a slot is free, so pages
+    are not extracted far ahead of generation. Returns the questions in
+    chunk order. Once a chunk raises, no further chunks are sent and the
+    error is re-raised.
+    """
+    slots = threading.Semaphore(concurrency)
+    failed = threading.Event()
+    futures = []
+
+    def run(text, index):
+        try:
+            return generate_chunk(text, index)
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, text in enumerate(chunks):
+            slots.acquire()
+            if failed.is_set():
+                slots.release()
+                break
+            if progress:
+                progress(f"Chunk {index + 1}: {len(text)} characters queued for generation")
+            futures.append(pool.submit(run, text, index))
+        questions = []
+        for future in futures:
+            questions.extend(future.result())
+    return questions
+
+
+def ingest(pages, generate_chunk, chunk_tokens=8000, concurrency=2, progress=None):
+    """Pages -> token-bounded chunks -> questions per chunk -> merged, deduplicated list.
+
+    Returns (questions, StageTimer). Extraction, chunking and generation
+    overlap, so each stage is charged only the time spent in it.
+    """
+    timer = StageTimer()
+    started = time.perf_counter()
+    chunks = timer.timed('chunk', chunk_pages(timer.timed('extract', pages), chunk_tokens))
+    questions = generate_from_chunks(chunks, generate_chunk, concurrency, progress)
+    elapsed = time.perf_counter() - started
+    # Pulling a chunk includes pulling its pages
+    timer.seconds['chunk'] = timer.seconds.get('chunk', 0.0) - timer.seconds.get('extract', 0.0)
+    timer.add('generate', elapsed - timer.seconds['chunk'] - timer.seconds.get('extract', 0.0))
+
+    merge_started = time.perf_counter()
+    merged = dedupe_questions(questions)
+    timer.add('merge', time.perf_counter() - merge_started)
+    if progress:
+        progress(f"Merged {len(questions)} generated questions into {len(merged)} unique ones")
+    return merged, timer
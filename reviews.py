@@ -0,0 +1,108 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+from scheduler import GRADES
+
+RATINGS = tuple(GRADES)
+# Clients may run a little ahead of the server; anything later is clamped to now
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+class ReviewLog:
+    """Append-only NDJSON log of applied reviews, the input to the scheduler optimizer."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, entries):
+        if not entries:
+            return
+        lines = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+    def __iter__(self):
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def parse_event_time(value, now):
+    """Epoch milliseconds (JavaScript's Date.now()) or an ISO string -> naive local datetime."""
+    if isinstance(value, bool):
+        raise ValueError('reviewed_at must be epoch milliseconds or an ISO 8601 string')
+    if isinstance(value, (int, float)):
+        when = datetime.fromtimestamp(value / 1000)
+    elif isinstance(value, str):
+        when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if when.tzinfo is not None:
+            when = when.astimezone().replace(tzinfo=None)
+    else:
+        raise ValueError('reviewed_at must be epoch milliseconds or an ISO 8601 string')
+    return min(when, now + MAX_CLOCK_SKEW)
+
+
+def review_key(card):
+    """Order of the last review applied to a card, for comparing against incoming events."""
+    return (card.get('last_reviewed_at') or '', card.get('last_review_id') or '')
+
+
+def apply_review_events(events, now, scheduler, applied=None):
+    """An index function for CachedCardStore.mutate that applies review events.
+
+    Each event is {"event_id", "card_id", "rating", "reviewed_at"}. A card's
+    events are applied in (reviewed_at, event_id) order, and only those newer
+    than the last review already applied to it, so re-sent events are no-ops
+    and a device that synced late can't undo a newer review from another.
+    The result is a summary of what happened to the events; applied events
+    are also appended to the `applied` list, if given, for the review log.
+    """
+    def apply(index):
+        summary = {'applied': 0, 'duplicate_or_stale': 0, 'unknown_card': 0, 'rejected': []}
+        by_card = {}
+        for event in events:
+            try:
+                if not isinstance(event, dict) or not event.get('event_id') or not event.get('card_id'):
+                    raise ValueError('event_id and card_id are required')
+                if event.get('rating') not in RATINGS:
+                    raise ValueError(f"rating must be one of: {', '.join(RATINGS)}")
+                when = parse_event_time(event.get('reviewed_at'), now)
+            except (TypeError, ValueError, OverflowError, OSError) as e:
+                event_id = event.get('event_id') if isinstance(event, dict) else None
+                summary['rejected'].append({'event_id': event_id, 'error': str(e)})
+                continue
+            by_card.setdefault(str(event['card_id']), []).append((when.isoformat(), str(event['event_id']), event['rating'], when))
+
+        changed = []
+        for card_id, card_events in by_card.items():
+            card = index.by_id.get(card_id)
+            if card is None:
+                summary['unknown_card'] += len(card_events)
+                continue
+            card = dict(card)
+            last = review_key(card)
+            for reviewed_at, event_id, rating, when in sorted(card_events):
+                if (reviewed_at, event_id) <= last:
+                    summary['duplicate_or_stale'] += 1
+                    continue
+                scheduler.review(card, rating, when)
+                card['last_review_id'] = event_id
+                if applied is not None:
+                    applied.append({'event_id': event_id, 'card_id': card_id, 'rating': rating,
+                                    'reviewed_at': reviewed_at})
+                last = (reviewed_at, event_id)
+                summary['applied'] += 1
+            if review_key(card) != review_key(index.by_id[card_id]):
+                index.put(card)
+                changed.append(card)
+        return summary, changed, ()
+    return apply
@@ -0,0 +1,342 @@
+"""Spaced-repetition schedulers.
+
+A scheduler turns a rating into the card's next interval and due date, and
+keeps whatever per-card state it needs in the card's compact `srs` dict
+(SM-2: ease factor `ef` and repetition count `n`; FSRS: stability `s` and
+difficulty `d`). `interval` (days) and `due_date` stay the source of truth
+for the rest of the app.
+
+Each scheduler also has a batch form, `batch_intervals`, used to reschedule
+a whole deck at once. It is written once against a small math namespace and
+runs either on NumPy arrays (one pass over the deck) or, without NumPy, on
+one card at a time.
+"""
+import math
+import zlib
+from datetime import datetime, timedelta
+
+from cache import due_timestamp
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+GRADES = {'again': 1, 'good': 3, 'easy': 4}
+DAY = 86400
+
+
+class _ScalarMath:
+    """The subset of NumPy's API the batch formulas use, for plain floats."""
+    exp = staticmethod(math.exp)
+    log = staticmethod(math.log)
+    power = staticmethod(pow)
+    maximum = staticmethod(max)
+    minimum = staticmethod(min)
+    floor = staticmethod(math.floor)
+
+    @staticmethod
+    def where(condition, a, b):
+        return a if condition else b
+
+
+def fuzz_unit(card_id, salt=''):
+    """A stable pseudo-random number in [-1, 1) for a card, so fuzz is reproducible."""
+    return zlib.crc32(f'{card_id}:{salt}'.encode('utf-8')) / 2 ** 31 - 1
+
+
+def fuzzed(interval, unit, xp=_ScalarMath):
+    """Spread intervals of 3+ days by up to ±5% (at least ±1 day) so reviews don't bunch up."""
+    spread = xp.maximum(1.0, interval * 0.05)
+    return xp.where(interval >= 3, xp.maximum(1.0, xp.floor(interval + unit * spread + 0.5)), interval)
+
+
+def last_review_timestamp(card):
+    """When the card was last reviewed; inferred from due_date - interval for older cards."""
+    if card.get('last_reviewed_at'):
+        try:
+            return datetime.fromisoformat(card['last_reviewed_at']).timestamp()
+        except ValueError:
+            pass
+    return due_timestamp(card) - (card.get('interval') or 0) * DAY
+
+
+class Scheduler:
+    name = None
+    fuzz = False
+    # Whether batch_intervals derives intervals from the memory state (and so
+    # can be fuzzed) rather than passing the current ones through
+    recomputes_intervals = False
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+        self.fuzz = self.params.get('fuzz', self.fuzz)
+
+    def next_interval(self, card, srs, rating, reviewed_at):
+        """Return (interval in days, new srs state) for a rating."""
+        raise NotImplementedError
+
+    def review(self, card, rating, reviewed_at):
+        """Apply a rating given at `reviewed_at` (naive local datetime) to the card in place."""
+        if rating not in GRADES:
+            return
+        srs = dict(card.get('srs') or {})
+        interval, srs = self.next_interval(card, srs, rating, reviewed_at)
+        if self.fuzz and interval:
+            interval = int(fuzzed(interval, fuzz_unit(card.get('id'), reviewed_at.isoformat())))
+        card['interval'] = interval
+        card['due_date'] = (reviewed_at + timedelta(days=interval)).isoformat()
+        card['last_reviewed_at'] = reviewed_at.isoformat()
+        if srs:
+            card['srs'] = srs
+
+    def seed_state(self, card):
+        """srs state for a card that was scheduled by another algorithm, or None to leave it."""
+        return None
+
+    def batch_intervals(self, interval, s, d, xp):
+        """New intervals for reviewed cards from their current interval and FSRS state."""
+        return interval
+
+
+class DoublingScheduler(Scheduler):
+    """The original rule: again resets, good doubles, easy quadruples the interval."""
+    name = 'doubling'
+
+    def next_interval(self, card, srs, rating, reviewed_at):
+        interval = card.get('interval') or 0
+        if rating == 'again':
+            return 0, srs
+        return max(1, interval * (2 if rating == 'good' else 4)), srs
+
+
+class SM2Scheduler(Scheduler):
+    """SuperMemo 2: a per-card ease factor that grows on easy answers and shrinks on lapses."""
+    name = 'sm2'
+    fuzz = True
+    QUALITY = {'again': 1, 'good': 4, 'easy': 5}
+
+    def next_interval(self, card, srs, rating, reviewed_at):
+        interval = card.get('interval') or 0
+        ef = srs.get('ef', self.params.get('initial_ease', 2.5))
+        # A card already in review when SM-2 was switched on continues from its interval
+        reps = srs.get('n', 2 if interval else 0)
+        q = self.QUALITY[rating]
+        if rating == 'again':
+            reps = 0
+            interval = 0
+        else:
+            reps += 1
+            interval = 1 if reps == 1 else 6 if reps == 2 else round(max(interval, 1) * ef)
+        ef = max(1.3, ef + 0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+        srs.update(ef=round(ef, 3), n=reps)
+        return interval, srs
+
+    def seed_state(self, card):
+        if 'ef' in (card.get('srs') or {}):
+            return None
+        return {'ef': self.params.get('initial_ease', 2.5), 'n': 2 if card.get('interval') else 0}
+
+
+# FSRS-4.5 default weights
+FSRS_WEIGHTS = [0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474, 0.1367,
+                1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755]
+FSRS_DECAY = -0.5
+FSRS_FACTOR = 0.9 ** (1 / FSRS_DECAY) - 1
+
+
+def retrievability(elapsed_days, stability, xp=_ScalarMath):
+    return xp.power(1 + FSRS_FACTOR * elapsed_days / stability, FSRS_DECAY)
+
+
+class FSRSScheduler(Scheduler):
+    """A Free Spaced Repetition Scheduler (v4.5) style memory model.
+
+    Each card has a stability (days until recall probability falls to 90%)
+    and a difficulty (1-10). The interval is the time until predicted recall
+    drops to `desired_retention`. Again still makes the card due right away,
+    as with the other schedulers, but lowers its stability.
+    """
+    name = 'fsrs'
+    fuzz = True
+    recomputes_intervals = True
+
+    def __init__(self, params=None):
+        super().__init__(params)
+        self.w = list(self.params.get('weights') or FSRS_WEIGHTS)
+        self.retention = self.params.get('desired_retention', 0.9)
+
+    def _interval_factor(self):
+        # Days per unit of stability for the desired retention (1.0 at 90%)
+        return (self.retention ** (1 / FSRS_DECAY) - 1) / FSRS_FACTOR
+
+    def _initial_difficulty(self, grade):
+        return min(10.0, max(1.0, self.w[4] - (grade - 3) * self.w[5]))
+
+    def next_interval(self, card, srs, rating, reviewed_at):
+        w = self.w
+        grade = GRADES[rating]
+        stability = srs.get('s')
+        difficulty = srs.get('d')
+        if stability is not None and difficulty is None:
+            difficulty = self._initial_difficulty(3)
+        if stability is None and card.get('interval'):
+            # Scheduled by another algorithm: its interval is our best guess at stability
+            stability, difficulty = float(card['interval']), self._initial_difficulty(3)
+        if stability is None:
+            stability = w[grade - 1]
+            difficulty = self._initial_difficulty(grade)
+        else:
+            elapsed = max(0.0, (reviewed_at.timestamp() - last_review_timestamp(card)) / DAY)
+            r = retrievability(elapsed, stability)
+            if grade == 1:
+                stability = (w[11] * difficulty ** -w[12] * ((stability + 1) ** w[13] - 1)
+                             * math.exp(w[14] * (1 - r)))
+            else:
+                bonus = w[16] if grade == 4 else 1.0
+                stability = stability * (1 + math.exp(w[8]) * (11 - difficulty) * stability ** -w[9]
+                                         * (math.exp(w[10] * (1 - r)) - 1) * bonus)
+            difficulty = w[7] * self._initial_difficulty(3) + (1 - w[7]) * (difficulty - w[6] * (grade - 3))
+            difficulty = min(10.0, max(1.0, difficulty))
+        stability = max(0.1, stability)
+        srs.update(s=round(stability, 4), d=round(difficulty, 4))
+        if grade == 1:
+            return 0, srs
+        return max(1, round(stability * self._interval_factor())), srs
+
+    def seed_state(self, card):
+        if 's' in (card.get('srs') or {}) or not card.get('interval'):
+            return None
+        return {'s': float(card['interval']), 'd': round(self._initial_difficulty(3), 4)}
+
+    def batch_intervals(self, interval, s, d, xp):
+        return xp.maximum(1.0, xp.floor(s * self._interval_factor() + 0.5))
+
+
+SCHEDULERS = {cls.name: cls for cls in (DoublingScheduler, SM2Scheduler, FSRSScheduler)}
+
+
+def get_scheduler(config):
+    """The scheduler selected by config "scheduler" (default: doubling)."""
+    name = config.get('scheduler', 'doubling')
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler: {name}")
+    return SCHEDULERS[name]((config.get('scheduler_params') or {}).get(name))
+
+
+def reschedule_cards(cards, scheduler, use_numpy=True):
+    """Recompute interval and due_date for every reviewed card under `scheduler`.
+
+    Cards without a review state for this scheduler are seeded from their
+    current interval. New and relearning cards (interval 0) are left as they
+    are. Returns the changed cards as new dicts.
+    """
+    cards = [card for card in cards if card.get('interval')]
+    if not cards:
+        return []
+    srs = []
+    for card in cards:
+        state = dict(card.get('srs') or {})
+        state.update(scheduler.seed_state(card) or {})
+        srs.append(state)
+    columns = {
+        'interval': [float(card['interval']) for card in cards],
+        's': [state.get('s', float(card['interval'])) for card, state in zip(cards, srs)],
+        'd': [state.get('d', 5.0) for state in srs],
+        'last': [last_review_timestamp(card) for card in cards],
+        'fuzz': [fuzz_unit(card.get('id')) for card in cards],
+    }
+    if numpy is not None and use_numpy:
+        xp = numpy
+        arrays = {name: numpy.asarray(values, dtype=float) for name, values in columns.items()}
+        intervals = scheduler.batch_intervals(arrays['interval'], arrays['s'], arrays['d'], xp)
+        intervals = numpy.broadcast_to(intervals, arrays['interval'].shape)
+        if scheduler.fuzz and scheduler.recomputes_intervals:
+            intervals = fuzzed(intervals, arrays['fuzz'], xp)
+        intervals = intervals.astype(int).tolist()
+        dues = (arrays['last'] + numpy.asarray(intervals) * DAY).tolist()
+    else:
+        intervals = []
+        dues = []
+        for interval, s, d, last, unit in zip(*columns.values()):
+            interval = scheduler.batch_intervals(interval, s, d, _ScalarMath)
+            if scheduler.fuzz and scheduler.recomputes_intervals:
+                interval = fuzzed(interval, unit)
+            intervals.append(int(interval))
+            dues.append(last + int(interval) * DAY)
+
+    changed = []
+    for card, state, interval, due in zip(cards, srs, intervals, dues):
+        if (interval == card['interval'] and abs(due - due_timestamp(card)) < 1
+                and state == (card.get('srs') or {})):
+            continue
+        card = dict(card, interval=interval, due_date=datetime.fromtimestamp(due).isoformat())
+        if state:
+            card['srs'] = state
+        changed.append(card)
+    return changed
+
+
+def _log_loss(stability, samples):
+    """Binary cross-entropy of recall predicted at each sample's elapsed time vs. the outcome."""
+    total = 0.0
+    for elapsed, recalled in samples:
+        r = min(max(retrievability(elapsed, stability), 1e-6), 1 - 1e-6)
+        total -= math.log(r) if recalled else math.log(1 - r)
+    return total / len(samples)
+
+
+def optimize_fsrs(log_entries, weights=None, min_samples=20):
+    """Fit FSRS initial stabilities (w0-w3) to a review log.
+
+    For every card reviewed at least twice, the first rating picks which
+    initial stability applies, and the gap to the second review plus whether
+    it was recalled (anything but 'again') is one sample. Each initial
+    stability is set to the value on a log-spaced grid that minimises the
+    log loss of its samples; ratings with fewer than `min_samples` samples
+    keep their weight. The other weights are left unchanged.
+
+    Returns (weights, report).
+    """
+    weights = list(weights or FSRS_WEIGHTS)
+    by_card = {}
+    for entry in log_entries:
+        try:
+            when = datetime.fromisoformat(entry['reviewed_at']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            continue
+        if entry.get('rating') in GRADES:
+            by_card.setdefault(entry.get('card_id'), []).append((when, entry['rating']))
+
+    samples = {grade: [] for grade in GRADES.values()}
+    for reviews in by_card.values():
+        if len(reviews) < 2:
+            continue
+        reviews.sort()
+        (first_at, first_rating), (second_at, second_rating) = reviews[0], reviews[1]
+        elapsed = (second_at - first_at) / DAY
+        # Re-presented within the session: says nothing about memory decay
+        if elapsed < 0.5:
+            continue
+        samples[GRADES[first_rating]].append((elapsed, second_rating != 'again'))
+
+    grid = [math.exp(math.log(0.1) + i * (math.log(365) - math.log(0.1)) / 199) for i in range(200)]
+    report = {}
+    for rating, grade in GRADES.items():
+        grade_samples = samples[grade]
+        entry = {'samples': len(grade_samples), 'stability': weights[grade - 1]}
+        if len(grade_samples) >= min_samples:
+            before = _log_loss(weights[grade - 1], grade_samples)
+            if numpy is not None:
+                elapsed = numpy.array([e for e, _ in grade_samples])
+                recalled = numpy.array([r for _, r in grade_samples], dtype=float)
+                r = numpy.clip(retrievability(elapsed[None, :], numpy.array(grid)[:, None], numpy), 1e-6, 1 - 1e-6)
+                losses = -(recalled * numpy.log(r) + (1 - recalled) * numpy.log(1 - r)).mean(axis=1)
+                best = grid[int(losses.argmin())]
+            else:
+                best = min(grid, key=lambda stability: _log_loss(stability, grade_samples))
+            weights[grade - 1] = round(best, 4)
+            entry.update(stability=weights[grade - 1], log_loss_before=round(before, 4),
+                         log_loss_after=round(_log_loss(best, grade_samples), 4))
+        report[rating] = entry
+    return weights, report
@@ -0,0 +1,123 @@
+import bisect
+import re
+import unicodedata
+
+# Arabic code points that Persian text often carries in place of the Persian
+# letters, plus Persian and Arabic-Indic digits
+_FOLD = str.maketrans({
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # alef maksura -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian keheh
+    '\u0629': '\u0647',  # teh marbuta -> heh
+    '\u0640': None,  # tatweel
+    '\u200c': None,  # zero-width non-joiner, which Persian uses inside words
+    **{chr(0x06f0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+_TOKEN = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Casefold, fold Persian/Arabic letter variants and digits, and drop accents and harakat."""
+    text = str(text)
+    if text.isascii():
+        return text.lower()
+    folded = text.casefold().translate(_FOLD)
+    decomposed = unicodedata.normalize('NFKD', folded)
+    if decomposed == folded:
+        # Nothing decomposed, so there are no combining marks to drop
+        return folded
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return _TOKEN.findall(normalize(text)) if text else []
+
+
+def card_tokens(card):
+    return frozenset(tokenize(card.get('question')) + tokenize(card.get('answer')))
+
+
+class InvertedIndex:
+    """Token -> card ids over question and answer, updated one card at a time.
+
+    The vocabulary is also kept sorted, so a prefix is a contiguous range of
+    it found with bisect.
+    """
+
+    # A prefix expands to at most this many vocabulary tokens (in sort order),
+    # so a one-letter query can't union the postings of the whole vocabulary
+    MAX_EXPANSIONS = 2000
+
+    def __init__(self, cards=()):
+        self.postings = {}
+        self._tokens = {}
+        # The question/answer each card was indexed with, so re-adding an unchanged card is cheap
+        self._texts = {}
+        for card in cards:
+            tokens = self._tokens[card['id']] = card_tokens(card)
+            self._texts[card['id']] = (card.get('question'), card.get('answer'))
+            for token in tokens:
+                self.postings.setdefault(token, set()).add(card['id'])
+        self.vocabulary = sorted(self.postings)
+
+    def ids(self):
+        return self._tokens.keys()
+
+    def add(self, card):
+        card_id = card['id']
+        text = (card.get('question'), card.get('answer'))
+        if card_id in self._texts and self._texts[card_id] == text:
+            return
+        self._texts[card_id] = text
+        tokens = card_tokens(card)
+        old = self._tokens.get(card_id, frozenset())
+        for token in old - tokens:
+            self._unpost(token, card_id)
+        for token in tokens - old:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                bisect.insort(self.vocabulary, token)
+            ids.add(card_id)
+        self._tokens[card_id] = tokens
+
+    def remove(self, card_id):
+        self._texts.pop(card_id, None)
+        for token in self._tokens.pop(card_id, ()):
+            self._unpost(token, card_id)
+
+    def _unpost(self, token, card_id):
+        ids = self.postings[token]
+        ids.discard(card_id)
+        if not ids:
+            del self.postings[token]
+            del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def _prefix_ids(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\U0010ffff')
+        ids = set()
+        for token in self.vocabulary[start:min(end, start + self.MAX_EXPANSIONS)]:
+            ids |= self.postings[token]
+        return ids
+
+    def search(self, query, within=None):
+        """Sorted ids of cards containing every query token; the last token also matches as a prefix.
+
+        `within` (a set or dict keys view of ids) restricts the result, e.g. to one deck.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        candidates = [self.postings.get(token, set()) for token in tokens[:-1]]
+        candidates.append(self._prefix_ids(tokens[-1]))
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for ids in candidates[1:]:
+            if not result:
+                break
+            result &= ids
+        if within is not None:
+            result &= within
+        return sorted(result)
@@ -74,6 +74,7 @@ let currentDeckId = null;
 let activeLearningQueue = []; // This will hold cards for the current session
 let currentCard = null; // The card currently being displayed
 let deckChart = null;
+let forecastChart = null;
 let questionLanguage = 'en-US'; // Default
 let answerLanguage = 'en-US'; // Default
 
@@ -131,6 +132,15 @@ function fetchDecks() {
                     fetchCards(currentDeckId);
                     openTab('manage-cards');
                 });
+                const deleteButton = document.createElement('button');
+                deleteButton.textContent = 'Delete';
+                deleteButton.className = 'btn btn-danger';
+                deleteButton.style.marginLeft = '10px';
+                deleteButton.addEventListener('click', event => {
+                    event.stopPropagation();
+                    deleteDeck(deck);
+                });
+                li.appendChild(deleteButton);
                 deckList.appendChild(li);
 
                 const option = document.createElement('option');
@@ -151,14 +161,29 @@ function fetchDecks() {
         });
 }
 
+const CARD_PAGE_SIZE = 200;
+
 function fetchCards(deckId) {
-    const url = deckId ? `/api/decks/${deckId}/cards` : '/api/cards';
-    fetch(url)
+    const cardList = document.getElementById('card-list');
+    cardList.innerHTML = '';
+    // Each call bumps the token, so pages from an older listing are dropped
+    const loadToken = cardList.dataset.loadToken = String(Date.now() + Math.random());
+    fetchCardPage(deckId, null, cardList, loadToken);
+}
+
+function fetchCardPage(deckId, afterId, cardList, loadToken) {
+    const params = new URLSearchParams({ limit: CARD_PAGE_SIZE, fields: 'id,question,answer' });
+    if (afterId) {
+        params.set('after_id', afterId);
+    }
+    fetch(`/api/decks/${deckId}/cards?${params}`)
         .then(response => response.json())
-        .then(cards => {
-            const cardList = document.getElementById('card-list');
-            cardList.innerHTML = '';
-            if (cards.length === 0) {
+        .then(page => {
+            if (cardList.dataset.loadToken !== loadToken) {
+                return;
+            }
+            const cards = page.cards;
+            if (cards.length === 0 && !afterId) {
                 cardList.innerHTML = '<p>No cards in this deck. Add some above!</p>';
                 return;
             }
@@ -186,6 +211,9 @@ function fetchCards(deckId) {
                     deleteCard(card.id, deckId);
                 });
             });
+            if (page.next_after_id) {
+                fetchCardPage(deckId, page.next_after_id, cardList, loadToken);
+            }
         });
 }
 
@@ -236,6 +264,26 @@ function editCard(cardId, deckId) {
     };
 }
 
+function deleteDeck(deck) {
+    if (!confirm(`Delete the deck "${deck.name}" and all of its cards?`)) {
+        return;
+    }
+    fetch(`/api/decks/${deck.id}`, { method: 'DELETE' })
+        .then(response => response.json().then(data => {
+            if (!response.ok) {
+                throw new Error(data.error || 'Failed to delete deck');
+            }
+            return data;
+        }))
+        .then(data => {
+            showNotification(`Deck deleted (${data.cards_deleted} cards).`);
+            fetchDecks();
+        })
+        .catch(error => {
+            showNotification(`Error deleting deck: ${error.message}`, 'error');
+        });
+}
+
 function deleteCard(cardId, deckId) {
     const modal = document.getElementById('delete-confirm-modal');
     modal.style.display = 'flex'; // Use flex to center modal
@@ -371,12 +419,16 @@ document.getElementById('import-button').addEventListener('click', () => {
         method: 'POST',
         body: formData,
     })
-    .then(response => {
+    .then(response => response.json().catch(() => ({})).then(data => {
         if (!response.ok) {
-            throw new Error('Failed to import cards');
+            // A file malformed partway through may still have imported some cards
+            if (data.imported) {
+                fetchCards(deckId);
+            }
+            throw new Error(data.message || data.error || 'Failed to import cards');
         }
-        return response.json();
-    })
+        return data;
+    }))
     .then(data => {
         showNotification(data.message, 'success');
         fetchCards(deckId);
@@ -572,6 +624,7 @@ document.getElementById('generate-quiz-from-flashcards-button').addEventListener
             }
             return response.json();
         })
+        .then(job => waitForJob(job, logElement))
         .then(data => {
             logElement.textContent = data.log;
             if (data.error) {
@@ -613,7 +666,7 @@ document.getElementById('start-learning-button').addEventListener('click', () =>
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), 10000); // 10 second timeout
 
-    fetch(`/api/learn/data?deck_id=${deckId}`, { signal: controller.signal })
+    fetch(`/api/learn/data?deck_id=${deckId}&fields=id,question,answer`, { signal: controller.signal })
         .then(response => {
             clearTimeout(timeoutId); // Clear the timeout if the fetch completes
             if (!response.ok) {
@@ -682,46 +735,150 @@ function displayNextLearningCard() {
     console.log("Current Card:", currentCard);
 }
 
-function rateCard(rating) {
-    fetch(`/api/learn/cards/${currentCard.id}/answer`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ rating }),
-    })
-    .then(response => {
-        if (!response.ok) {
-            throw new Error('Failed to rate card');
-        }
-        return response.json();
-    })
-    .then(() => {
-        if (rating === 'again') {
-            againCount++;
-            // Re-add the card to the active queue for re-presentation
-            // Add it to a random position to avoid immediate repetition
-            const insertIndex = Math.floor(Math.random() * (activeLearningQueue.length + 1));
-            activeLearningQueue.splice(insertIndex, 0, currentCard);
-            // remainingCount does not change as the card is re-added to the queue
-            showNotification('Card marked "Again". Will reappear later.', 'info');
-        } else { // 'good' or 'easy'
-            if (rating === 'good') {
-                goodCount++;
-            } else if (rating === 'easy') {
-                easyCount++;
+// Ratings are recorded locally (IndexedDB) and uploaded in batches to
+// /api/learn/sync, so moving to the next card never waits on the network.
+const SYNC_INTERVAL = 15000;
+const SYNC_BATCH_SIZE = 1000;
+const REVIEW_DB_NAME = 'flashcard-reviews';
+const REVIEW_STORE = 'events';
+let reviewDbPromise = null;
+let memoryReviewQueue = []; // Used when IndexedDB isn't available
+let syncInProgress = false;
+
+function openReviewDb() {
+    if (!reviewDbPromise) {
+        reviewDbPromise = new Promise((resolve) => {
+            if (!window.indexedDB) {
+                resolve(null);
+                return;
             }
-            remainingCount--; // Decrement only if card is "finished" for this session
-            showNotification(`Card marked "${rating.charAt(0).toUpperCase() + rating.slice(1)}"!`, 'success');
+            const request = indexedDB.open(REVIEW_DB_NAME, 1);
+            request.onupgradeneeded = () => {
+                request.result.createObjectStore(REVIEW_STORE, { keyPath: 'event_id' });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => resolve(null);
+        });
+    }
+    return reviewDbPromise;
+}
+
+function reviewStoreRequest(mode, action) {
+    return openReviewDb().then(db => {
+        if (!db) {
+            return action(null);
         }
-        updateLearningProgressBar();
-        
-        // Move to the next card
-        displayNextLearningCard();
-    })
-    .catch(error => {
-        showNotification(`Error rating card: ${error.message}`, 'error');
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(REVIEW_STORE, mode);
+            const result = action(tx.objectStore(REVIEW_STORE));
+            tx.oncomplete = () => resolve(result && result.result !== undefined ? result.result : result);
+            tx.onerror = () => reject(tx.error);
+        });
+    });
+}
+
+function newEventId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+function queueReview(cardId, rating) {
+    const event = { event_id: newEventId(), card_id: cardId, rating, reviewed_at: Date.now() };
+    return reviewStoreRequest('readwrite', store => {
+        if (!store) {
+            memoryReviewQueue.push(event);
+            return null;
+        }
+        return store.put(event);
+    }).catch(error => {
+        console.error('Could not store review locally:', error);
+        memoryReviewQueue.push(event);
+    });
+}
+
+function pendingReviews(limit) {
+    return reviewStoreRequest('readonly', store => (store ? store.getAll(null, limit) : []))
+        .then(events => events.concat(memoryReviewQueue).slice(0, limit));
+}
+
+function forgetReviews(events) {
+    const sent = new Set(events.map(event => event.event_id));
+    memoryReviewQueue = memoryReviewQueue.filter(event => !sent.has(event.event_id));
+    return reviewStoreRequest('readwrite', store => {
+        if (store) {
+            events.forEach(event => store.delete(event.event_id));
+        }
+        return null;
+    });
+}
+
+function syncReviews() {
+    if (syncInProgress || !navigator.onLine) {
+        return Promise.resolve();
+    }
+    syncInProgress = true;
+    const uploadBatch = () => pendingReviews(SYNC_BATCH_SIZE).then(events => {
+        if (!events || events.length === 0) {
+            return null;
+        }
+        return fetch('/api/learn/sync', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ events }),
+        })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Sync failed with status ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(summary => {
+            if (summary.rejected.length) {
+                console.warn('Some reviews were rejected by the server:', summary.rejected);
+            }
+            // The server has every event in this batch (applied, duplicate or rejected)
+            return forgetReviews(events).then(() => events.length === SYNC_BATCH_SIZE ? uploadBatch() : null);
+        });
     });
+    return uploadBatch()
+        .catch(error => console.error('Review sync failed, will retry:', error))
+        .finally(() => { syncInProgress = false; });
+}
+
+setInterval(syncReviews, SYNC_INTERVAL);
+window.addEventListener('online', syncReviews);
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+        syncReviews();
+    }
+});
+syncReviews();
+
+function rateCard(rating) {
+    queueReview(currentCard.id, rating);
+    if (rating === 'again') {
+        againCount++;
+        // Re-add the card to the active queue for re-presentation
+        // Add it to a random position to avoid immediate repetition
+        const insertIndex = Math.floor(Math.random() * (activeLearningQueue.length + 1));
+        activeLearningQueue.splice(insertIndex, 0, currentCard);
+        // remainingCount does not change as the card is re-added to the queue
+        showNotification('Card marked "Again". Will reappear later.', 'info');
+    } else { // 'good' or 'easy'
+        if (rating === 'good') {
+            goodCount++;
+        } else if (rating === 'easy') {
+            easyCount++;
+        }
+        remainingCount--; // Decrement only if card is "finished" for this session
+        showNotification(`Card marked "${rating.charAt(0).toUpperCase() + rating.slice(1)}"!`, 'success');
+    }
+    updateLearningProgressBar();
+
+    // Move to the next card
+    displayNextLearningCard();
 }
 
 function endLearningSession() {
@@ -741,11 +898,13 @@ function endLearningSession() {
     remainingCount = 0;
     updateLearningProgressBar();
 
-    // Refresh stats after learning session ends
+    // Upload the session's reviews, then refresh stats
     const currentDeckId = document.getElementById('learning-deck-select').value;
-    if (currentDeckId) {
-        showDeckStats(currentDeckId);
-    }
+    syncReviews().then(() => {
+        if (currentDeckId) {
+            showDeckStats(currentDeckId);
+        }
+    });
 }
 
 function showDeckStats(deckId) {
@@ -763,6 +922,7 @@ function showDeckStats(deckId) {
                 <p><strong>New Cards:</strong> ${stats.to_learn_count}</p>
                 <p><strong>Learning Cards:</strong> ${stats.learning_count}</p>
                 <p><strong>Mature Cards:</strong> ${stats.mastered_count}</p>
+                <p><strong>Due Today:</strong> ${stats.due_today}</p>
             `;
 
             const chartCanvas = document.getElementById('deck-chart');
@@ -797,6 +957,7 @@ function showDeckStats(deckId) {
             });
 
             document.getElementById('deck-stats-container').style.display = 'block';
+            showDeckForecast(deckId);
         })
         .catch(error => {
             showNotification(`Error fetching deck stats: ${error.message}`, 'error');
@@ -804,6 +965,47 @@ function showDeckStats(deckId) {
         });
 }
 
+function showDeckForecast(deckId) {
+    fetch(`/api/deck/${deckId}/forecast?days=30`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Failed to fetch due forecast');
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (forecastChart) {
+                forecastChart.destroy();
+            }
+            forecastChart = new Chart(document.getElementById('deck-forecast-chart'), {
+                type: 'bar',
+                data: {
+                    labels: data.forecast.map(day => day.date.slice(5)),
+                    datasets: [{
+                        label: 'Cards due',
+                        data: data.forecast.map(day => day.due),
+                        backgroundColor: '#36A2EB'
+                    }]
+                },
+                options: {
+                    responsive: true,
+                    plugins: {
+                        legend: {
+                            display: false
+                        },
+                        title: {
+                            display: true,
+                            text: 'Due Forecast (next 30 days)'
+                        }
+                    }
+                }
+            });
+        })
+        .catch(error => {
+            showNotification(`Error fetching due forecast: ${error.message}`, 'error');
+        });
+}
+
 document.getElementById('learning-deck-select').addEventListener('change', (event) => {
     const deckId = event.target.value;
     if (deckId) {
@@ -846,6 +1048,7 @@ document.getElementById('generate-cards-form').addEventListener('submit', event
         }
         return response.json();
     })
+    .then(job => waitForJob(job, logElement))
     .then(data => {
         logElement.textContent = data.log;
         if (data.error) {
@@ -880,6 +1083,12 @@ document.getElementById('create-quiz-form').addEventListener('submit', event =>
     const formData = new FormData();
     formData.append('file', file);
     formData.append('quiz_type', quizType);
+    const saveToDeck = document.getElementById('pdf-save-to-deck').checked;
+    const deckId = document.getElementById('ai-deck-select').value;
+    if (saveToDeck && deckId) {
+        formData.append('save_to_deck', '1');
+        formData.append('deck_id', deckId);
+    }
 
     const logContainer = document.getElementById('ai-log-container');
     const logElement = document.getElementById('ai-log');
@@ -897,6 +1106,7 @@ document.getElementById('create-quiz-form').addEventListener('submit', event =>
         }
         return response.json();
     })
+    .then(job => waitForJob(job, logElement))
     .then(data => {
         logElement.textContent = data.log;
         if (data.error) {
@@ -913,6 +1123,12 @@ document.getElementById('create-quiz-form').addEventListener('submit', event =>
         document.getElementById('progress-bar').style.width = '0%';
         displayQuestion();
         showNotification('Quiz created from PDF successfully!', 'success');
+        if (data.cards_added !== undefined) {
+            showNotification(`${data.cards_added} questions added as cards to the deck.`, 'success');
+            if (document.getElementById('learning-deck-select').value === deckId) {
+                showDeckStats(deckId);
+            }
+        }
     })
     .catch(error => {
         showNotification(`Error creating quiz from PDF: ${error.message}`, 'error');
@@ -920,6 +1136,38 @@ document.getElementById('create-quiz-form').addEventListener('submit', event =>
     });
 });
 
+const JOB_POLL_INTERVAL = 1000;
+
+// AI endpoints answer with a background job; poll it until it finishes and
+// resolve with its result (or with { error, log } if it failed).
+function waitForJob(job, logElement) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(`/api/jobs/${job.job_id}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error('Failed to fetch job status');
+                    }
+                    return response.json();
+                })
+                .then(status => {
+                    if (status.log) {
+                        logElement.textContent = status.log;
+                    }
+                    if (status.status === 'succeeded') {
+                        resolve(status.result);
+                    } else if (status.status === 'queued' || status.status === 'running') {
+                        setTimeout(poll, JOB_POLL_INTERVAL);
+                    } else {
+                        resolve({ error: status.error, log: status.log });
+                    }
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
+
 function fetchSettings() {
     fetch('/api/settings')
         .then(response => response.json())
@@ -0,0 +1,481 @@
+import json
+import os
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+# Columns that get their own SQLite column; any other card keys are kept in
+# the `extra` JSON blob so nothing is lost on the way in or out.
+CARD_FIELDS = ('question', 'answer', 'deck_id', 'id', 'interval', 'due_date')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    id TEXT PRIMARY KEY,
+    deck_id TEXT,
+    question TEXT,
+    answer TEXT,
+    interval INTEGER,
+    due_date TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cards_deck ON cards (deck_id);
+CREATE TABLE IF NOT EXISTS decks (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    card_id TEXT
+);
+"""
+
+
+CROCKFORD32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+_id_lock = threading.Lock()
+_last_id = [0, 0]  # [timestamp ms, random part]
+
+
+def new_id():
+    """ULID-style id: 48-bit millisecond timestamp + 80 random bits, Crockford base32.
+
+    Ids sort by creation time and are monotonic within this process: several
+    ids in the same millisecond increment the random part instead of redrawing it.
+    """
+    with _id_lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_id[0]:
+            now_ms = _last_id[0]
+            rand = _last_id[1] + 1
+        else:
+            rand = secrets.randbits(80)
+        _last_id[0], _last_id[1] = now_ms, rand
+    value = (now_ms << 80) | (rand & ((1 << 80) - 1))
+    return ''.join(CROCKFORD32[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@contextmanager
+def atomic_file(path):
+    """Open a temp file (binary) to write `path` through, so readers only ever see the old or the new file.
+
+    The temp file is in the same directory; on success it is fsynced and
+    renamed over the target with os.replace, on error it is removed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def write_json(path, data):
+    """Write JSON atomically (see atomic_file). Returns the number of bytes written.
+
+    Compact and UTF-8 rather than indented and \\u-escaped: Persian text
+    takes a third of the space, and large collections load faster.
+    """
+    encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with atomic_file(path) as f:
+        f.write(encoded)
+    return len(encoded)
+
+
+def file_stamp(path):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on `path` across threads (threading.Lock) and processes (flock).
+
+    Not reentrant: do not nest two file_lock() calls on the same path.
+    """
+    with _thread_locks_guard:
+        lock = _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class GroupCommitter:
+    """Serializes writes and flushes the ones that queue up together in one go.
+
+    `submit(fn)` blocks until fn has been applied and persisted. The first
+    writer to arrive becomes the leader: it waits `window` seconds for others
+    to queue behind it, then hands the whole batch to `flush`, which must set
+    `slot['result']` or `slot['error']` for every slot.
+    """
+
+    def __init__(self, flush, window=0.002):
+        self._flush = flush
+        self.window = window
+        self._pending = []
+        self._flushing = False
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.commits = 0
+
+    def submit(self, fn):
+        slot = {'fn': fn, 'done': False}
+        with self._cond:
+            self._pending.append(slot)
+            while not slot['done'] and self._flushing:
+                self._cond.wait()
+            leader = not slot['done']
+            if leader:
+                self._flushing = True
+        if leader:
+            try:
+                if self.window:
+                    time.sleep(self.window)
+                with self._cond:
+                    batch, self._pending = self._pending, []
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    for s in batch:
+                        s.setdefault('error', e)
+                self.batches += 1
+                self.commits += len(batch)
+            finally:
+                with self._cond:
+                    for s in batch:
+                        s['done'] = True
+                    self._flushing = False
+                    self._cond.notify_all()
+        if 'error' in slot:
+            raise slot['error']
+        return slot.get('result')
+
+
+class JsonCardStore:
+    """The original storage: every card lives in one JSON array on disk."""
+
+    # Any change means rewriting the whole file.
+    row_level = False
+    change_feed = False
+
+    def __init__(self, cards_file, decks_file):
+        self.cards_file = cards_file
+        self.decks_file = decks_file
+        self.lock_path = cards_file + '.lock'
+        self.decks_lock_path = decks_file + '.lock'
+        self.bytes_written = 0
+
+    def stamp(self):
+        return file_stamp(self.cards_file)
+
+    def all_cards(self):
+        return read_json(self.cards_file, [])
+
+    def cards_in_deck(self, deck_id):
+        return [card for card in self.all_cards() if card.get('deck_id') == deck_id]
+
+    def get_card(self, card_id):
+        return next((c for c in self.all_cards() if c['id'] == card_id), None)
+
+    def put_card(self, card):
+        self.put_cards([card])
+
+    def put_cards(self, new_cards):
+        cards = self.all_cards()
+        positions = {c['id']: i for i, c in enumerate(cards)}
+        for card in new_cards:
+            if card['id'] in positions:
+                cards[positions[card['id']]] = card
+            else:
+                positions[card['id']] = len(cards)
+                cards.append(card)
+        self.replace_cards(cards)
+
+    def delete_card(self, card_id):
+        cards = self.all_cards()
+        remaining = [c for c in cards if c['id'] != card_id]
+        self.replace_cards(remaining)
+        return len(remaining) != len(cards)
+
+    def replace_cards(self, cards):
+        self.bytes_written += write_json(self.cards_file, cards)
+
+    def get_decks(self):
+        return read_json(self.decks_file, [])
+
+    def save_decks(self, decks):
+        write_json(self.decks_file, decks)
+
+
+class SqliteCardStore:
+    """Cards in SQLite (WAL mode), keyed by id with a secondary index on deck_id.
+
+    Reviewing or editing a card touches a single row instead of rewriting the
+    whole collection. Every write also appends the ids it touched to the
+    `changes` table, so other processes can catch up with changes_since
+    instead of reading the whole collection again.
+    """
+
+    row_level = True
+    change_feed = True
+    # Rows kept in the change feed; a reader further behind than this reloads everything
+    CHANGE_FEED_ROWS = 10000
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock_path = db_file + '.lock'
+        self.decks_lock_path = db_file + '.lock'
+        self._local = threading.local()
+        # Card payload (text columns) sent to SQLite; page and WAL overhead not included
+        self.bytes_written = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        if hasattr(os, 'register_at_fork'):
+            # A forked child (a gunicorn worker after preload) must not reuse the parent's connection
+            os.register_at_fork(after_in_child=self._forget_connections)
+
+    def _forget_connections(self):
+        self._local = threading.local()
+
+    def stamp(self):
+        # Commits land in the WAL first, so watch both files.
+        return (file_stamp(self.db_file), file_stamp(self.db_file + '-wal'))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _card_to_row(card):
+        extra = {k: v for k, v in card.items() if k not in CARD_FIELDS}
+        return (
+            str(card['id']),
+            card.get('deck_id'),
+            card.get('question'),
+            card.get('answer'),
+            card.get('interval'),
+            card.get('due_date'),
+            json.dumps(extra) if extra else None,
+        )
+
+    @staticmethod
+    def _row_to_card(row):
+        card = {}
+        for field in CARD_FIELDS:
+            if row[field] is not None:
+                card[field] = row[field]
+        if row['extra']:
+            card.update(json.loads(row['extra']))
+        return card
+
+    def _query_cards(self, sql, params=()):
+        rows = self._connect().execute(sql, params).fetchall()
+        return [self._row_to_card(row) for row in rows]
+
+    def all_cards(self):
+        return self._query_cards('SELECT * FROM cards ORDER BY rowid')
+
+    def cards_in_deck(self, deck_id):
+        return self._query_cards('SELECT * FROM cards WHERE deck_id = ? ORDER BY rowid', (deck_id,))
+
+    def get_card(self, card_id):
+        cards = self._query_cards('SELECT * FROM cards WHERE id = ?', (card_id,))
+        return cards[0] if cards else None
+
+    def put_card(self, card):
+        self.put_cards([card])
+
+    def put_cards(self, cards):
+        with self._connect() as conn:
+            self._upsert(conn, cards)
+            self._log_changes(conn, [str(card['id']) for card in cards])
+
+    def _log_changes(self, conn, card_ids):
+        # A NULL card_id tells readers to reload everything
+        if len(card_ids) > self.CHANGE_FEED_ROWS:
+            card_ids = [None]
+        conn.executemany('INSERT INTO changes (card_id) VALUES (?)', [(card_id,) for card_id in card_ids])
+        conn.execute('DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?', (self.CHANGE_FEED_ROWS,))
+
+    def last_change(self):
+        return self._connect().execute('SELECT MAX(seq) FROM changes').fetchone()[0] or 0
+
+    def changes_since(self, seq):
+        """(latest seq, changed cards, deleted ids) for writes after `seq`.
+
+        None when the reader has to reload the whole collection instead: the
+        feed no longer reaches back to `seq`, or the collection was replaced.
+        """
+        conn = self._connect()
+        # One read transaction, so the feed and the rows it points at agree
+        conn.execute('BEGIN')
+        try:
+            rows = conn.execute('SELECT seq, card_id FROM changes WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+            if not rows:
+                return seq, [], []
+            if rows[0]['seq'] != seq + 1 or any(row['card_id'] is None for row in rows):
+                return None
+            card_ids = list(dict.fromkeys(row['card_id'] for row in rows))
+            changed = []
+            for start in range(0, len(card_ids), 500):
+                chunk = card_ids[start:start + 500]
+                changed += self._query_cards(
+                    f"SELECT * FROM cards WHERE id IN ({', '.join('?' * len(chunk))}) ORDER BY rowid", chunk)
+        finally:
+            conn.rollback()
+        found = {card['id'] for card in changed}
+        return rows[-1]['seq'], changed, [card_id for card_id in card_ids if card_id not in found]
+
+    def _upsert(self, conn, cards):
+        rows = [self._card_to_row(card) for card in cards]
+        self.bytes_written += sum(len(value.encode('utf-8')) for row in rows for value in row if isinstance(value, str))
+        # ON CONFLICT keeps the original rowid, so cards stay in insertion order.
+        conn.executemany(
+            'INSERT INTO cards (id, deck_id, question, answer, interval, due_date, extra) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET deck_id = excluded.deck_id, question = excluded.question, '
+            'answer = excluded.answer, interval = excluded.interval, due_date = excluded.due_date, '
+            'extra = excluded.extra',
+            rows,
+        )
+
+    def delete_card(self, card_id):
+        with self._connect() as conn:
+            self._log_changes(conn, [card_id])
+            return conn.execute('DELETE FROM cards WHERE id = ?', (card_id,)).rowcount > 0
+
+    def apply_changes(self, changed, deleted):
+        """Upsert `changed` cards and delete `deleted` ids in one transaction."""
+        with self._connect() as conn:
+            if changed:
+                self._upsert(conn, changed)
+            if deleted:
+                conn.executemany('DELETE FROM cards WHERE id = ?', [(card_id,) for card_id in deleted])
+            self._log_changes(conn, [str(card['id']) for card in changed] + list(deleted))
+
+    def replace_cards(self, cards):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cards')
+            self._upsert(conn, cards)
+            self._log_changes(conn, [None])
+
+    def get_decks(self):
+        decks = []
+        for row in self._connect().execute('SELECT * FROM decks ORDER BY rowid'):
+            deck = {'name': row['name'], 'id': row['id']}
+            if row['extra']:
+                deck.update(json.loads(row['extra']))
+            decks.append(deck)
+        return decks
+
+    def save_decks(self, decks):
+        rows = []
+        for deck in decks:
+            extra = {k: v for k, v in deck.items() if k not in ('id', 'name')}
+            rows.append((str(deck['id']), deck.get('name'), json.dumps(extra) if extra else None))
+        with self._connect() as conn:
+            conn.execute('DELETE FROM decks')
+            conn.executemany('INSERT OR REPLACE INTO decks (id, name, extra) VALUES (?, ?, ?)', rows)
+
+    def get_meta(self, key):
+        row = self._connect().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+
+def migrate_json_to_sqlite(store, cards_file, decks_file):
+    """One-shot import of cards.json/decks.json into a SqliteCardStore.
+
+    Returns the number of cards imported, or None if the store was already
+    migrated. Cards sharing an id collapse onto the last one, as the id is
+    now a primary key.
+    """
+    # Under the writers' lock: workers starting together must not import
+    # cards.json again over answers the first one has already saved
+    with file_lock(store.lock_path):
+        if store.get_meta('migrated_from_json'):
+            return None
+        cards = read_json(cards_file, [])
+        decks = read_json(decks_file, [])
+        with store._connect() as conn:
+            store._upsert(conn, cards)
+            store._log_changes(conn, [None])
+        if decks:
+            store.save_decks(decks)
+        store.set_meta('migrated_from_json', f'{len(cards)} cards, {len(decks)} decks')
+    return len(cards)
+
+
+def open_store(config, cards_file, decks_file):
+    backend = config.get('card_store', 'json')
+    if backend == 'json':
+        return JsonCardStore(cards_file, decks_file)
+    if backend == 'sqlite':
+        store = SqliteCardStore(config.get('card_store_path', 'cards.db'))
+        migrate_json_to_sqlite(store, cards_file, decks_file)
+        return store
+    raise ValueError(f'Unknown card_store backend: {backend}')
+
+
+if __name__ == '__main__':
+    # python store.py [cards.db] -- migrate cards.json/decks.json into SQLite
+    db_file = sys.argv[1] if len(sys.argv) > 1 else 'cards.db'
+    imported = migrate_json_to_sqlite(SqliteCardStore(db_file), 'cards.json', 'decks.json')
+    if imported is None:
+        print(f'{db_file} was already migrated.')
+    else:
+        print(f'Migrated {imported} cards into {db_file}.')
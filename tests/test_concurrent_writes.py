@@ -0,0 +1,73 @@
+"""Concurrent answers must never be lost.
+
+Two processes, each with a pool of threads, answer disjoint halves of the
+cards through the Flask test client against a temporary copy of
+cards.json. The store is then read back from disk and every card must carry
+the last_review_id its answer returned.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from store import open_store  # noqa: E402
+
+PROCESSES = 2
+THREADS = 16
+ANSWERS = 200
+
+
+def answer_cards(directory, card_ids, results):
+    # Runs in a fresh (spawned) process, so the app is set up from this directory's config.json
+    os.chdir(directory)
+    sys.path.insert(0, ROOT)
+    import app
+    client = app.app.test_client()
+
+    def answer(card_id):
+        response = client.post(f'/api/learn/cards/{card_id}/answer', json={'rating': 'good'})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return card_id, response.get_json()['last_review_id']
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        results.put(dict(pool.map(answer, card_ids)))
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_no_answers_lost(tmp_path, backend):
+    for name in ('cards.json', 'decks.json'):
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    config = {'card_store': backend, 'card_store_path': str(tmp_path / 'cards.db'), 'disable_google_login': True,
+              'gemini_backend': 'fake', 'scheduler': 'doubling'}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    with open(os.path.join(ROOT, 'cards.json')) as f:
+        original = {card['id']: card for card in json.load(f)[:ANSWERS]}
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    ids = list(original)
+    workers = [context.Process(target=answer_cards, args=(str(tmp_path), ids[i::PROCESSES], results))
+               for i in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    review_ids = {}
+    for _ in workers:
+        review_ids.update(results.get(timeout=120))
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+    assert len(review_ids) == len(original)
+
+    store = open_store(config, str(tmp_path / 'cards.json'), str(tmp_path / 'decks.json'))
+    cards = {card['id']: card for card in store.all_cards()}
+    lost = [card_id for card_id, review_id in review_ids.items() if cards[card_id].get('last_review_id') != review_id]
+    assert not lost, f'{len(lost)} of {len(review_ids)} answers lost'
+    for card_id, card in original.items():
+        assert cards[card_id]['interval'] == max(1, card.get('interval', 0) * 2)
@@ -0,0 +1,68 @@
+"""The streaming JSON array parser, fed in chunks small enough to split every token."""
+import io
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import importer  # noqa: E402
+from importer import ImportFormatError, import_stream, iter_json_array  # noqa: E402
+
+ITEMS = [
+    {'question': 'Comma, bracket ] and brace } inside a string', 'answer': '[not, an, array]'},
+    {'question': 'فتوسنتز چیست؟', 'answer': 'ساخت قند با نور — ✓'},
+    12345678901234567890,
+    -0.5e-3,
+    'plain string with "quotes" and \\ backslash',
+    [1, [2, [3]], {'nested': None}],
+    True,
+    None,
+    {},
+    [],
+]
+
+
+def parse(text, chunk_size, monkeypatch):
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', chunk_size)
+    return list(iter_json_array(io.BytesIO(text.encode('utf-8'))))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 65536])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_items_split_across_chunks(monkeypatch, chunk_size, indent):
+    text = json.dumps(ITEMS, ensure_ascii=False, indent=indent)
+    assert parse(text, chunk_size, monkeypatch) == ITEMS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 65536])
+def test_number_at_chunk_end_is_not_cut(monkeypatch, chunk_size):
+    assert parse('[1, 22, 333, 4444]', chunk_size, monkeypatch) == [1, 22, 333, 4444]
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '﻿[]'])
+def test_empty_array(monkeypatch, text):
+    assert parse(text, 1, monkeypatch) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 65536])
+@pytest.mark.parametrize('text', ['[1,,2]', '[1 2]', '[1,]', '[,1]', '[,]', '[1 , , 2]', '[{"a": 1} {"a": 2}]',
+                                  '[1, 2', '[1,', '[', '', '{"question": "q"}', '[1, tru]'])
+def test_malformed(monkeypatch, chunk_size, text):
+    with pytest.raises(ImportFormatError):
+        parse(text, chunk_size, monkeypatch)
+
+
+def test_partial_report_keeps_committed_batches(monkeypatch):
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', 5)
+    cards = [{'question': f'q{i}', 'answer': f'a{i}'} for i in range(5)]
+    text = json.dumps(cards)[:-1] + ' {"question": "q5", "answer": "a5"}]'
+    committed = []
+    report = import_stream(io.BytesIO(text.encode('utf-8')), 'cards.json', 'deck', [],
+                           lambda batch: committed.extend(batch), batch_size=2)
+    assert report['imported'] == 4
+    assert [card['question'] for card in committed] == ['q0', 'q1', 'q2', 'q3']
+    assert 'error' in report
@@ -0,0 +1,153 @@
+"""Offline review sync (POST /api/learn/sync): retries, late devices and event times.
+
+The app runs in-process against a temporary collection; each test adds its
+own fresh cards, so they start from the same state.
+"""
+import json
+import os
+import shutil
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# What a review sets on a card, apart from last_review_id (event ids differ between cards)
+SCHEDULING = ('interval', 'due_date', 'srs', 'last_reviewed_at')
+
+
+@pytest.fixture(scope='module')
+def workdir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('sync')
+    for name in ('cards.json', 'decks.json'):
+        shutil.copy(os.path.join(ROOT, name), directory / name)
+    config = {'card_store': 'json', 'disable_google_login': True, 'gemini_backend': 'fake', 'scheduler': 'doubling'}
+    (directory / 'config.json').write_text(json.dumps(config))
+    return directory
+
+
+@pytest.fixture
+def client(workdir, monkeypatch):
+    # The app opens cards.json and config.json relative to the working directory
+    monkeypatch.chdir(workdir)
+    import app
+    return app.app.test_client()
+
+
+def new_card(client):
+    response = client.post('/api/cards', json={'question': f'q {uuid.uuid4()}', 'answer': 'a', 'deck_id': 'sync'})
+    assert response.status_code == 200
+    return response.get_json()['id']
+
+
+def get_card(client, card_id):
+    return client.get(f'/api/cards/{card_id}').get_json()
+
+
+def scheduling(card):
+    return {field: card.get(field) for field in SCHEDULING}
+
+
+def event(card_id, rating, when):
+    return {'event_id': str(uuid.uuid4()), 'card_id': card_id, 'rating': rating, 'reviewed_at': when}
+
+
+def sync(client, events):
+    response = client.post('/api/learn/sync', json={'events': events})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def ms(when):
+    return int(when.timestamp() * 1000)
+
+
+BASE = datetime.now() - timedelta(days=2)
+
+
+def test_resending_a_batch_changes_nothing(client):
+    card_id = new_card(client)
+    events = [event(card_id, 'good', ms(BASE)), event(card_id, 'easy', ms(BASE + timedelta(hours=1)))]
+    assert sync(client, events)['applied'] == 2
+    after_first = get_card(client, card_id)
+
+    summary = sync(client, events)
+    assert summary['applied'] == 0
+    assert summary['duplicate_or_stale'] == 2
+    assert get_card(client, card_id) == after_first
+
+
+def test_events_are_applied_in_time_order_whatever_order_they_arrive_in(client):
+    in_order, reversed_order = new_card(client), new_card(client)
+    times = [ms(BASE + timedelta(hours=hour)) for hour in range(3)]
+    ratings = ['good', 'again', 'easy']
+
+    sync(client, [event(in_order, rating, when) for rating, when in zip(ratings, times)])
+    sync(client, [event(reversed_order, rating, when) for rating, when in reversed(list(zip(ratings, times)))])
+
+    assert scheduling(get_card(client, reversed_order)) == scheduling(get_card(client, in_order))
+
+
+def test_two_devices_syncing_out_of_order(client):
+    # Device A reviewed at t0 and t2, device B at t1 and t3; B syncs first
+    card_id, reference = new_card(client), new_card(client)
+    times = [ms(BASE + timedelta(hours=hour)) for hour in range(4)]
+    device_a = [event(card_id, 'again', times[0]), event(card_id, 'easy', times[2])]
+    device_b = [event(card_id, 'good', times[1]), event(card_id, 'good', times[3])]
+
+    assert sync(client, device_b)['applied'] == 2
+    summary = sync(client, device_a)
+    # Both of A's reviews are older than B's last one, so they can't undo it
+    assert summary['applied'] == 0
+    assert summary['duplicate_or_stale'] == 2
+
+    sync(client, [event(reference, 'good', times[1]), event(reference, 'good', times[3])])
+    card = get_card(client, card_id)
+    assert card['last_review_id'] == device_b[1]['event_id']
+    assert scheduling(card) == scheduling(get_card(client, reference))
+
+
+def test_newer_event_wins_and_older_one_is_ignored(client):
+    card_id = new_card(client)
+    sync(client, [event(card_id, 'easy', ms(BASE + timedelta(hours=2)))])
+    after_newer = get_card(client, card_id)
+
+    summary = sync(client, [event(card_id, 'again', ms(BASE + timedelta(hours=1)))])
+    assert summary == {'applied': 0, 'duplicate_or_stale': 1, 'unknown_card': 0, 'rejected': []}
+    assert get_card(client, card_id) == after_newer
+
+    latest = event(card_id, 'again', ms(BASE + timedelta(hours=3)))
+    assert sync(client, [latest])['applied'] == 1
+    card = get_card(client, card_id)
+    assert card['last_review_id'] == latest['event_id']
+    assert card['last_reviewed_at'] > after_newer['last_reviewed_at']
+
+
+def test_iso_and_epoch_ms_times_are_the_same_review(client):
+    from_ms, from_iso, from_utc = new_card(client), new_card(client), new_card(client)
+    when = BASE.replace(microsecond=0)
+    utc = when.astimezone(timezone.utc).replace(tzinfo=None)
+
+    summary = sync(client, [event(from_ms, 'good', ms(when)), event(from_iso, 'good', when.isoformat()),
+                            event(from_utc, 'good', utc.isoformat() + 'Z')])
+    assert summary['applied'] == 3
+    assert summary['rejected'] == []
+
+    cards = [get_card(client, card_id) for card_id in (from_ms, from_iso, from_utc)]
+    assert cards[0]['last_reviewed_at'] == when.isoformat()
+    for card in cards[1:]:
+        assert card['last_reviewed_at'] == cards[0]['last_reviewed_at']
+        assert card['due_date'] == cards[0]['due_date']
+        assert card['interval'] == cards[0]['interval']
+
+
+def test_malformed_events_are_rejected_one_by_one(client):
+    card_id = new_card(client)
+    summary = sync(client, [event(card_id, 'meh', ms(BASE)), event(card_id, 'good', 'yesterday'),
+                            event('no-such-card', 'good', ms(BASE)), event(card_id, 'good', ms(BASE))])
+    assert summary['applied'] == 1
+    assert summary['unknown_card'] == 1
+    assert len(summary['rejected']) == 2